@@ -0,0 +1,224 @@
+"""
+Offline check of the Gemini upload and prompt caches against local stand-ins
+No API key or network needed:
+    python check_gemini_cache.py [--image path/to/image.png]
+"""
+
+import os
+import json
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+from gemini_cache import FileUploadCache, PromptContextCache
+from image_sources import list_image_files
+from sg_adapter_eval import SGAdapterEvaluator, TOKEN_PRICES, CACHED_INPUT_PRICE_FACTOR
+
+
+RESPONSE_TEXT = json.dumps({"scene_graph": [["man", "hug", "dog"]], "entities": ["man", "dog"]})
+PROMPT_TOKENS = 1000
+CACHED_PROMPT_TOKENS = 900
+OUTPUT_TOKENS = 100
+
+
+def standin_response(cached_tokens: int = 0):
+    usage = SimpleNamespace(
+        prompt_token_count=PROMPT_TOKENS,
+        cached_content_token_count=cached_tokens,
+        candidates_token_count=OUTPUT_TOKENS
+    )
+    return SimpleNamespace(text=RESPONSE_TEXT, usage_metadata=usage)
+
+
+class NotFound(Exception):
+    """Named like google.api_core.exceptions.NotFound"""
+
+
+class StandInFiles:
+    """File API stand-in: hands out file URIs and can forget them (remote deletion/expiry)"""
+
+    def __init__(self):
+        self.live = set()
+        self.uploads = 0
+
+    def upload_file(self, path, mime_type, display_name):
+        self.uploads += 1
+        uri = f"standin://files/{display_name}-{self.uploads}"
+        self.live.add(uri)
+        return SimpleNamespace(name=f"files/{display_name}", uri=uri, mime_type=mime_type)
+
+
+class StandInModel:
+    """GenerativeModel stand-in that rejects file parts whose URI is no longer live"""
+
+    def __init__(self, model_name: str, files: StandInFiles):
+        self.model_name = f"models/{model_name}"
+        self.files = files
+        self.requests = []
+
+    def generate_content(self, contents, **kwargs):
+        for part in contents:
+            file_data = part.get("file_data") if isinstance(part, dict) else None
+            if file_data is not None and file_data["file_uri"] not in self.files.live:
+                raise NotFound(f"404 File {file_data['file_uri']} not found")
+        self.requests.append("file" if any(isinstance(p, dict) for p in contents) else "inline")
+        return standin_response()
+
+
+class StandInCaches:
+    """CachedContent stand-in: creates prompt caches that can be deleted or expire remotely"""
+
+    def __init__(self):
+        self.live = set()
+        self.created = 0
+        self.deleted = 0
+
+    def create(self, model, contents, ttl, display_name):
+        self.created += 1
+        name = f"cachedContents/{display_name}-{self.created}"
+        self.live.add(name)
+
+        def delete():
+            self.deleted += 1
+            self.live.discard(name)
+
+        return SimpleNamespace(name=name, model=model, contents=contents, delete=delete)
+
+
+class StandInCachedModel:
+    """Model bound to a cached prompt; fails like the API once the cache is gone"""
+
+    def __init__(self, cached, caches: StandInCaches):
+        self.model_name = f"models/{cached.model}"
+        self.cached = cached
+        self.caches = caches
+        self.requests = 0
+
+    def generate_content(self, contents, **kwargs):
+        if self.cached.name not in self.caches.live:
+            raise NotFound(f"404 CachedContent not found (or permission denied): {self.cached.name}")
+        self.requests += 1
+        return standin_response(cached_tokens=CACHED_PROMPT_TOKENS)
+
+
+def make_evaluator(cache_file: str, files: StandInFiles, models: dict) -> SGAdapterEvaluator:
+    """Fresh evaluator (as in a new run) sharing the persisted upload cache"""
+    def model_factory(model_name):
+        models[model_name] = StandInModel(model_name, files)
+        return models[model_name]
+
+    return SGAdapterEvaluator(
+        upload_cache=FileUploadCache(cache_file, client=files),
+        model_factory=model_factory
+    )
+
+
+def check_context_cache(image_path: str):
+    caches = StandInCaches()
+    models = {}
+    evaluator = SGAdapterEvaluator(
+        context_cache=PromptContextCache(
+            client=caches,
+            model_factory=lambda cached: StandInCachedModel(cached, caches)
+        ),
+        model_factory=lambda model_name: models.setdefault(model_name, StandInModel(model_name, StandInFiles()))
+    )
+    context_cache = evaluator.context_cache
+
+    # First request creates the cached prompt and sends only the image
+    result = evaluator.extract_scene_graph_from_image(image_path)
+    assert "error" not in result, result
+    assert caches.created == 1, caches.created
+    entry, = context_cache.entries.values()
+    assert entry["model"].requests == 1
+    print("✓ Prompt cached once and referenced by the first request")
+
+    # Cached prompt tokens are recorded separately and billed at the cached rate
+    price_in, price_out = TOKEN_PRICES[evaluator.model_name]
+    expected_cost = (price_in * (PROMPT_TOKENS - CACHED_PROMPT_TOKENS) +
+                     price_in * CACHED_INPUT_PRICE_FACTOR * CACHED_PROMPT_TOKENS +
+                     price_out * OUTPUT_TOKENS) / 1e6
+    assert evaluator.usage["cached_tokens"] == CACHED_PROMPT_TOKENS, evaluator.usage
+    assert abs(evaluator.usage["cost"] - expected_cost) < 1e-12, evaluator.usage
+    print("✓ Cached prompt tokens recorded and priced at the cached rate")
+
+    # Another image (or sample) reuses the same cached prompt
+    evaluator.extract_scene_graph_from_image(image_path, sample=1)
+    assert caches.created == 1, caches.created
+    assert context_cache.stats["hits"] == 1
+    assert entry["model"].requests == 2
+    print("✓ Cached prompt reused on the second request")
+
+    # The cache expires remotely: a 404 drops the entry and the full prompt is sent
+    caches.live.clear()
+    result = evaluator.extract_scene_graph_from_image(image_path, sample=2)
+    assert "error" not in result, result
+    assert not context_cache.entries
+    assert caches.deleted == 1
+    assert models[evaluator.model_name].requests == ["inline"]
+    print("✓ 404 invalidated the cached prompt and the full prompt was sent")
+
+    # The next request creates a fresh cache
+    evaluator.extract_scene_graph_from_image(image_path, sample=3)
+    assert caches.created == 2, caches.created
+    print("✓ Cached prompt recreated after invalidation")
+
+
+def check_upload_cache(image_path: str):
+    files = StandInFiles()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_file = os.path.join(tmp_dir, "uploaded_files.json")
+
+        # First run uploads the image once and references it by handle
+        models = {}
+        evaluator = make_evaluator(cache_file, files, models)
+        result = evaluator.extract_scene_graph_from_image(image_path)
+        assert "error" not in result, result
+        assert files.uploads == 1, files.uploads
+        assert models[evaluator.model_name].requests == ["file"]
+        print("✓ Image uploaded once and referenced by handle")
+
+        # Second run reuses the persisted handle without uploading again
+        models = {}
+        evaluator = make_evaluator(cache_file, files, models)
+        evaluator.extract_scene_graph_from_image(image_path)
+        assert files.uploads == 1, files.uploads
+        assert evaluator.upload_cache.stats["hits"] == 1
+        assert models[evaluator.model_name].requests == ["file"]
+        print("✓ Persisted handle reused on the second pass")
+
+        # The file disappears remotely: a 404 drops the handle and the image goes inline
+        files.live.clear()
+        models = {}
+        evaluator = make_evaluator(cache_file, files, models)
+        result = evaluator.extract_scene_graph_from_image(image_path)
+        assert "error" not in result, result
+        assert models[evaluator.model_name].requests == ["inline"]
+        assert not evaluator.upload_cache.entries
+        with open(cache_file, 'r') as f:
+            assert json.load(f) == {}
+        print("✓ 404 invalidated the handle and the request was resent inline")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the Gemini caches against local stand-ins")
+    parser.add_argument(
+        "--image",
+        type=str,
+        default=None,
+        help="Image to use (defaults to the first gnn_run image)"
+    )
+    args = parser.parse_args()
+
+    image_path = args.image
+    if image_path is None:
+        image_path = list_image_files("gnn_run/images-30000/images-30000")[0]
+
+    check_upload_cache(image_path)
+    check_context_cache(image_path)
+    print("\nAll cache checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Caching of Gemini server-side resources
+Uploaded image files are reused across evaluations instead of re-sending image bytes inline,
+and the static prompt prefix is stored once as cached content instead of being resent per request
+"""
+
+import io
+import os
+import json
+import time
+import datetime
+import mimetypes
+import threading
+from typing import Dict
+
+import google.generativeai as genai
+
+from image_sources import is_archive_member, read_image_bytes
+
+
+# Files uploaded through the File API are deleted after 48 hours
+DEFAULT_FILE_TTL = 48 * 3600
+
+
+def is_missing_resource_error(error: Exception, resource: str) -> bool:
+    """
+    Whether an API error says a referenced server resource no longer exists
+    (deleted, expired, or not accessible with this key)
+
+    Args:
+        error: Exception raised by a request
+        resource: Resource named in the error message ("file" or "cachedcontent")
+    Rate limits, timeouts and unrelated invalid requests return False.
+    """
+    name = type(error).__name__
+    message = str(error).lower().replace(" ", "")
+    if resource not in message:
+        return False
+    if name in ("NotFound", "PermissionDenied"):
+        return True
+    return name == "InvalidArgument" and any(
+        phrase in message for phrase in ("notfound", "expired", "notexist")
+    )
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether an API error is worth retrying later (rate limit, timeout, server error)"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return type(error).__name__ in (
+        "ResourceExhausted", "TooManyRequests", "DeadlineExceeded", "ServiceUnavailable",
+        "InternalServerError", "GatewayTimeout", "Aborted"
+    )
+
+
+class FileUploadCache:
+    """
+    Persistent mapping from image content hash to an uploaded Gemini file
+
+    Each image is uploaded once; later requests reference it by URI. Entries
+    are refreshed when they are about to expire. The client only needs an
+    upload_file(path=..., mime_type=..., display_name=...) method returning
+    an object with name, uri, mime_type and (optionally) expiration_time,
+    so a local stand-in can be passed instead of the genai module.
+    """
+
+    def __init__(self,
+                 cache_file: str = "evaluation_results/uploaded_files.json",
+                 client=genai,
+                 expiry_margin: float = 600):
+        """
+        Args:
+            cache_file: JSON file persisting content hash -> file handle
+            client: Object providing upload_file (defaults to google.generativeai)
+            expiry_margin: Re-upload files expiring within this many seconds
+        """
+        self.cache_file = cache_file
+        self.client = client
+        self.expiry_margin = expiry_margin
+        self.stats = {"uploads": 0, "hits": 0, "failures": 0}
+
+        self._lock = threading.Lock()
+        self._upload_locks = {}
+        self.entries = self._load()
+
+    def _load(self) -> Dict:
+        """Load persisted handles, dropping expired ones"""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+
+        with open(self.cache_file, 'r') as f:
+            entries = json.load(f)
+
+        return {
+            content_hash: entry for content_hash, entry in entries.items()
+            if not self._is_expired(entry)
+        }
+
+    def _save(self):
+        """Atomically write the handle mapping to disk"""
+        if not self.cache_file:
+            return
+
+        directory = os.path.dirname(self.cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_file, self.cache_file)
+
+    def _is_expired(self, entry: Dict) -> bool:
+        return entry["expires_at"] - self.expiry_margin <= time.time()
+
+    @staticmethod
+    def _expiration_timestamp(uploaded) -> float:
+        """Expiry of an uploaded file as a unix timestamp"""
+        expiration = getattr(uploaded, "expiration_time", None)
+        if expiration is None:
+            return time.time() + DEFAULT_FILE_TTL
+        if hasattr(expiration, "timestamp"):
+            return expiration.timestamp()
+        return float(expiration)
+
+    def _upload(self, image_path: str, content_hash: str) -> Dict:
+        mime_type = mimetypes.guess_type(image_path)[0] or "image/png"
+
+        # Archive members are uploaded from memory
+        source = image_path
+        if is_archive_member(image_path):
+            source = io.BytesIO(read_image_bytes(image_path))
+
+        uploaded = self.client.upload_file(
+            path=source,
+            mime_type=mime_type,
+            display_name=content_hash[:16]
+        )
+
+        return {
+            "name": uploaded.name,
+            "uri": uploaded.uri,
+            "mime_type": getattr(uploaded, "mime_type", None) or mime_type,
+            "expires_at": self._expiration_timestamp(uploaded),
+        }
+
+    def get_part(self, image_path: str, content_hash: str):
+        """
+        Return a file_data content part referencing the uploaded image,
+        uploading it first if needed. Returns None if the upload fails so
+        the caller can fall back to sending the image inline.
+        """
+        with self._lock:
+            upload_lock = self._upload_locks.setdefault(content_hash, threading.Lock())
+
+        # Concurrent callers for the same image wait for a single upload
+        with upload_lock:
+            entry = self.entries.get(content_hash)
+            if entry is not None and not self._is_expired(entry):
+                self.stats["hits"] += 1
+            else:
+                try:
+                    entry = self._upload(image_path, content_hash)
+                except Exception as e:
+                    print(f"Upload failed for {image_path}, sending inline: {e}")
+                    self.stats["failures"] += 1
+                    return None
+
+                self.stats["uploads"] += 1
+                with self._lock:
+                    self.entries[content_hash] = entry
+                    self._save()
+
+        return {"file_data": {"mime_type": entry["mime_type"], "file_uri": entry["uri"]}}
+
+    def invalidate(self, content_hash: str):
+        """Forget a handle (e.g. after the backend rejected it)"""
+        with self._lock:
+            if self.entries.pop(content_hash, None) is not None:
+                self._save()
+
+
+class PromptContextCache:
+    """
+    Server-side cached content holding the static extraction prompt
+
+    One cached-content entry is created per (model, prompt) and reused by
+    every request until its TTL runs out. If the backend can't cache (old
+    SDK, unsupported model, prompt below the minimum cache size) the model
+    is remembered as unsupported and get_model returns None, so callers send
+    the full prompt as before; after a transient failure (rate limit,
+    timeout) creation is simply tried again on the next request. For a
+    local stand-in, pass a client with create(model=..., contents=...,
+    ttl=..., display_name=...) and a model_factory turning the returned
+    object into a model.
+    """
+
+    def __init__(self, ttl: float = 3600, client=None, model_factory=None, expiry_margin: float = 60):
+        """
+        Args:
+            ttl: Lifetime of each cached-content entry (seconds)
+            client: Object providing create (defaults to genai.caching.CachedContent)
+            model_factory: Builds a model from a cached-content entry
+                (defaults to genai.GenerativeModel.from_cached_content)
+            expiry_margin: Recreate entries expiring within this many seconds
+        """
+        self.ttl = ttl
+        self.client = client
+        self.model_factory = model_factory
+        self.expiry_margin = expiry_margin
+        self.stats = {"created": 0, "hits": 0, "failures": 0}
+
+        self._lock = threading.Lock()
+        self.entries = {}
+        self._unsupported = set()
+
+    def _create(self, model_name: str, prompt: str):
+        client = self.client
+        if client is None:
+            client = genai.caching.CachedContent
+        model_factory = self.model_factory
+        if model_factory is None:
+            model_factory = lambda cached: genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+        cached = client.create(
+            model=model_name,
+            contents=[prompt],
+            ttl=datetime.timedelta(seconds=self.ttl),
+            display_name="sg-eval-prompt"
+        )
+        return cached, model_factory(cached)
+
+    def get_model(self, model_name: str, prompt: str):
+        """Model bound to the cached prompt, or None if caching isn't available"""
+        key = (model_name, prompt)
+        with self._lock:
+            if model_name in self._unsupported:
+                return None
+
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires_at"] - self.expiry_margin > time.time():
+                self.stats["hits"] += 1
+                return entry["model"]
+
+            try:
+                cached, model = self._create(model_name, prompt)
+            except Exception as e:
+                self.stats["failures"] += 1
+                if is_transient_error(e):
+                    print(f"Could not create cached prompt for {model_name} (will retry), sending full prompt: {e}")
+                    return None
+                print(f"Context caching unavailable for {model_name}, sending full prompt: {e}")
+                self._unsupported.add(model_name)
+                return None
+
+            self.stats["created"] += 1
+            self.entries[key] = {
+                "cached": cached,
+                "model": model,
+                "expires_at": time.time() + self.ttl
+            }
+            return model
+
+    @staticmethod
+    def _delete(entry: Dict):
+        try:
+            entry["cached"].delete()
+        except Exception as e:
+            print(f"Could not delete cached content: {e}")
+
+    def invalidate(self, model_name: str, prompt: str):
+        """
+        Drop an entry the backend reported as missing or expired; it is also
+        deleted on the server in case it still exists there
+        """
+        with self._lock:
+            entry = self.entries.pop((model_name, prompt), None)
+        if entry is not None:
+            self._delete(entry)
+
+    def clear(self):
+        """Delete all cached-content entries on the server"""
+        with self._lock:
+            entries, self.entries = self.entries, {}
+
+        for entry in entries.values():
+            self._delete(entry)
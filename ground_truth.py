@@ -0,0 +1,478 @@
+"""
+Precompiled ground-truth scene graphs for the MultiRels dataset
+Compiles metadata.jsonl / valdata.jsonl and the per-predicate text.json caption templates
+into one binary artifact that evaluators memory-map instead of parsing JSON on every run.
+
+Usage:
+    python ground_truth.py --dataset_dir dataset/MultiRels
+"""
+
+import os
+import sys
+import json
+import mmap
+import glob
+import array
+import struct
+import hashlib
+import argparse
+from collections.abc import Sequence
+from typing import List, Dict, Set, Tuple
+
+
+ARTIFACT_NAME = "ground_truth.sgbin"
+SPLIT_FILES = ["metadata.jsonl", "valdata.jsonl"]
+
+MAGIC = b"SGGT"
+FORMAT_VERSION = 3
+
+# magic, format version, source hash, then section counts:
+# strings, splits, scenes, object refs, triples, caption variants
+HEADER = struct.Struct("<4sI32s6I")
+# split: name id, first scene, scene count, source list id
+# (newline-separated paths relative to the dataset dir), source stamp
+SPLIT = struct.Struct("<4I32s")
+# Byte offset of the source stamp within a split record
+SPLIT_STAMP_OFFSET = 16
+# scene: file name id, caption id, first object, object count,
+# first triple, triple count, first caption variant, variant count
+SCENE = struct.Struct("<8I")
+# triple: subject slot, predicate id, object slot (slots index the scene's objects)
+TRIPLE = struct.Struct("<3I")
+# Sections in file order: string offsets, splits, scenes, object refs, triples,
+# caption variants, scene ids sorted by file name (one per scene), string data
+
+
+def source_files(dataset_dir: str) -> List[str]:
+    """Files the artifact is compiled from, in a stable order"""
+    files = [os.path.join(dataset_dir, name) for name in SPLIT_FILES]
+    files = [f for f in files if os.path.exists(f)]
+    files += sorted(glob.glob(os.path.join(dataset_dir, "train", "*", "text.json")))
+    return files
+
+
+def source_hash(dataset_dir: str) -> bytes:
+    """SHA-256 over the relative paths and contents of all source files"""
+    digest = hashlib.sha256()
+    for path in source_files(dataset_dir):
+        digest.update(os.path.relpath(path, dataset_dir).encode("utf-8"))
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.digest()
+
+
+def source_stamp(dataset_dir: str, relative_paths: List[str]) -> bytes:
+    """Cheap freshness stamp: SHA-256 over path, size and mtime of the given files (missing ones included)"""
+    digest = hashlib.sha256()
+    for relative_path in relative_paths:
+        try:
+            stat = os.stat(os.path.join(dataset_dir, relative_path))
+            entry = f"{relative_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0"
+        except FileNotFoundError:
+            entry = f"{relative_path}\0missing\0"
+        digest.update(entry.encode("utf-8"))
+    return digest.digest()
+
+
+def _caption_variants(dataset_dir: str, file_name: str, predicate: str, templates_cache: Dict) -> List[str]:
+    """Caption variants from the text.json next to the image, filled with the predicate"""
+    template_file = os.path.join(dataset_dir, os.path.dirname(file_name), "text.json")
+    if template_file not in templates_cache:
+        templates = {}
+        if os.path.exists(template_file):
+            with open(template_file, 'r') as f:
+                templates = json.load(f)
+        templates_cache[template_file] = templates
+
+    templates = templates_cache[template_file].get(os.path.basename(file_name), [])
+    return [template.replace("{}", predicate) for template in templates]
+
+
+def compile_ground_truth(dataset_dir: str, output_file: str = None) -> str:
+    """
+    Compile the dataset's metadata files into a binary artifact
+
+    Args:
+        dataset_dir: Dataset root (e.g., dataset/MultiRels)
+        output_file: Artifact path (defaults to <dataset_dir>/ground_truth.sgbin)
+    Returns: path of the written artifact
+    """
+    if output_file is None:
+        output_file = os.path.join(dataset_dir, ARTIFACT_NAME)
+
+    strings = []
+    string_ids = {}
+
+    def intern(value: str) -> int:
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    splits = []
+    scenes = []
+    object_refs = []
+    triples = []
+    variants = []
+    templates_cache = {}
+
+    for split_file in SPLIT_FILES:
+        path = os.path.join(dataset_dir, split_file)
+        if not os.path.exists(path):
+            continue
+
+        first_scene = len(scenes)
+        template_files = set()
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+
+                objects = data['objects']
+                relations = data['relations']
+                predicate = relations[0][1] if relations else ""
+                caption_variants = _caption_variants(dataset_dir, data['file_name'], predicate, templates_cache)
+                template_files.add(os.path.join(os.path.dirname(data['file_name']), "text.json"))
+
+                scenes.append((
+                    intern(data['file_name']),
+                    intern(data['caption']),
+                    len(object_refs), len(objects),
+                    len(triples), len(relations),
+                    len(variants), len(caption_variants)
+                ))
+                object_refs.extend(intern(obj) for obj in objects)
+                triples.extend((int(rel[0]), intern(rel[1]), int(rel[2])) for rel in relations)
+                variants.extend(intern(caption) for caption in caption_variants)
+
+        # A split only depends on its own file and the templates its scenes use
+        split_sources = [split_file] + sorted(template_files)
+        splits.append((
+            intern(os.path.splitext(split_file)[0]), first_scene, len(scenes) - first_scene,
+            intern("\n".join(split_sources)), source_stamp(dataset_dir, split_sources)
+        ))
+
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    # Lets scene_index binary-search file names; duplicates keep file order
+    by_file_name = sorted(range(len(scenes)), key=lambda scene_id: (encoded[scenes[scene_id][0]], scene_id))
+
+    # Written next to the target and swapped in, so open mappings of the old artifact stay valid
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(
+            MAGIC, FORMAT_VERSION, source_hash(dataset_dir),
+            len(strings), len(splits), len(scenes), len(object_refs), len(triples), len(variants)
+        ))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        for split in splits:
+            f.write(SPLIT.pack(*split))
+        for scene in scenes:
+            f.write(SCENE.pack(*scene))
+        f.write(struct.pack(f"<{len(object_refs)}I", *object_refs))
+        for triple in triples:
+            f.write(TRIPLE.pack(*triple))
+        f.write(struct.pack(f"<{len(variants)}I", *variants))
+        f.write(struct.pack(f"<{len(by_file_name)}I", *by_file_name))
+        f.write(b"".join(encoded))
+    os.replace(tmp_file, output_file)
+
+    print(f"✓ Compiled {len(scenes)} scenes ({len(splits)} splits, {len(strings)} strings) to {output_file}")
+    return output_file
+
+
+class SplitScenes(Sequence):
+    """Scenes of one split; each scene is decoded on first access"""
+
+    def __init__(self, artifact: "GroundTruthArtifact", first_scene: int, n_scenes: int):
+        self.artifact = artifact
+        self.first_scene = first_scene
+        self.n_scenes = n_scenes
+        self._decoded = {}
+
+    def __len__(self) -> int:
+        return self.n_scenes
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.n_scenes))]
+        if index < 0:
+            index += self.n_scenes
+        if not 0 <= index < self.n_scenes:
+            raise IndexError("scene index out of range")
+        if index not in self._decoded:
+            self._decoded[index] = self.artifact.scene(self.first_scene + index)
+        return self._decoded[index]
+
+    def vocabulary(self) -> Tuple[Set[str], Set[str]]:
+        """(objects, predicates) used by the split, read from the index arrays without decoding scenes"""
+        return self.artifact.vocabulary(self.first_scene, self.n_scenes)
+
+
+class GroundTruthArtifact:
+    """
+    Memory-mapped view of a compiled ground-truth artifact
+
+    Index sections are read as u32 arrays over the mapping and scenes are
+    decoded lazily. Use as a context manager or call close() when done.
+    """
+
+    def __init__(self, artifact_file: str):
+        self.artifact_file = artifact_file
+        self._file = open(artifact_file, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # (size, mtime) of the file as mapped; open_artifact reopens when it changes
+        self.file_key = _file_key(os.fstat(self._file.fileno()))
+
+        (magic, version, self.source_hash, n_strings, n_splits, n_scenes,
+         n_object_refs, n_triples, n_variants) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Not a ground-truth artifact (version {FORMAT_VERSION}): {artifact_file}")
+
+        # Section offsets
+        offsets_at = HEADER.size
+        splits_at = offsets_at + 4 * (n_strings + 1)
+        scenes_at = splits_at + SPLIT.size * n_splits
+        objects_at = scenes_at + SCENE.size * n_scenes
+        triples_at = objects_at + 4 * n_object_refs
+        variants_at = triples_at + TRIPLE.size * n_triples
+        by_file_name_at = variants_at + 4 * n_variants
+        self._strings_at = by_file_name_at + 4 * n_scenes
+
+        self._string_offsets = self._u32_array(offsets_at, n_strings + 1)
+        self._scene_table = self._u32_array(scenes_at, 8 * n_scenes)
+        self._object_refs = self._u32_array(objects_at, n_object_refs)
+        self._triple_table = self._u32_array(triples_at, 3 * n_triples)
+        self._variant_refs = self._u32_array(variants_at, n_variants)
+        self._scenes_by_file_name = self._u32_array(by_file_name_at, n_scenes)
+
+        self._strings = {}
+        self.n_scenes = n_scenes
+        self.splits = {}
+        self._split_sources = {}
+        for i in range(n_splits):
+            record_at = splits_at + i * SPLIT.size
+            name_id, first_scene, n_split_scenes, sources_id, stamp = SPLIT.unpack_from(self._mmap, record_at)
+            name = self.string(name_id)
+            self.splits[name] = (first_scene, n_split_scenes)
+            self._split_sources[name] = [self.string(sources_id).split("\n"), stamp, record_at]
+
+    def _u32_array(self, offset: int, count: int):
+        """Little-endian u32 section as an indexable array (zero-copy on little-endian hosts)"""
+        view = memoryview(self._mmap)[offset:offset + 4 * count]
+        if sys.byteorder == "little":
+            return view.cast("I")
+        values = array.array("I", view.tobytes())
+        values.byteswap()
+        view.release()
+        return values
+
+    def close(self):
+        """Release the memory mapping and the file"""
+        for name in ("_string_offsets", "_scene_table", "_object_refs", "_triple_table",
+                     "_variant_refs", "_scenes_by_file_name"):
+            section = getattr(self, name, None)
+            if isinstance(section, memoryview):
+                section.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _string_bytes(self, string_id: int) -> bytes:
+        start = self._strings_at + self._string_offsets[string_id]
+        end = self._strings_at + self._string_offsets[string_id + 1]
+        return self._mmap[start:end]
+
+    def string(self, string_id: int) -> str:
+        value = self._strings.get(string_id)
+        if value is None:
+            value = self._strings[string_id] = self._string_bytes(string_id).decode("utf-8")
+        return value
+
+    def scene(self, scene_id: int) -> Dict:
+        """One scene, in the same format as SGAdapterEvaluator.load_metadata plus caption variants"""
+        (file_name_id, caption_id, first_object, n_objects,
+         first_triple, n_triples, first_variant, n_variants) = self._scene_table[8 * scene_id:8 * scene_id + 8]
+
+        objects = [self.string(i) for i in self._object_refs[first_object:first_object + n_objects]]
+
+        relations = []
+        scene_graph = []
+        triples = self._triple_table[3 * first_triple:3 * (first_triple + n_triples)]
+        for i in range(0, len(triples), 3):
+            subj_idx, predicate_id, obj_idx = triples[i:i + 3]
+            predicate = self.string(predicate_id)
+            relations.append([str(subj_idx), predicate, str(obj_idx)])
+            scene_graph.append([objects[subj_idx], predicate, objects[obj_idx]])
+
+        return {
+            'file_name': self.string(file_name_id),
+            'caption': self.string(caption_id),
+            'scene_graph': scene_graph,
+            'objects': objects,
+            'relations': relations,
+            'caption_variants': [
+                self.string(i) for i in self._variant_refs[first_variant:first_variant + n_variants]
+            ]
+        }
+
+    def vocabulary(self, first_scene: int, n_scenes: int) -> Tuple[Set[str], Set[str]]:
+        """(objects, predicates) of a contiguous scene range"""
+        if n_scenes == 0:
+            return set(), set()
+        first_row, last_row = 8 * first_scene, 8 * (first_scene + n_scenes - 1)
+        objects_from = self._scene_table[first_row + 2]
+        objects_to = self._scene_table[last_row + 2] + self._scene_table[last_row + 3]
+        triples_from = self._scene_table[first_row + 4]
+        triples_to = self._scene_table[last_row + 4] + self._scene_table[last_row + 5]
+
+        objects = {self.string(i) for i in set(self._object_refs[objects_from:objects_to])}
+        predicates = {self.string(i) for i in set(self._triple_table[3 * triples_from + 1:3 * triples_to:3])}
+        return objects, predicates
+
+    def load_split(self, split: str) -> SplitScenes:
+        """All scenes of a split ('metadata' or 'valdata'), preserving file order"""
+        first_scene, n_split_scenes = self.splits[split]
+        return SplitScenes(self, first_scene, n_split_scenes)
+
+    def scene_index(self, file_name: str) -> int:
+        """
+        Scene id for an image file name (e.g., 'train/carved_by/2.jpg')
+        Binary search over the stored file-name order; only the probed names are read.
+        """
+        target = file_name.encode("utf-8")
+        low, high = 0, self.n_scenes
+        while low < high:
+            middle = (low + high) // 2
+            if self._string_bytes(self._scene_table[8 * self._scenes_by_file_name[middle]]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_scenes:
+            scene_id = self._scenes_by_file_name[low]
+            if self._string_bytes(self._scene_table[8 * scene_id]) == target:
+                return scene_id
+        raise KeyError(file_name)
+
+    def is_fresh(self, dataset_dir: str, split: str = None) -> bool:
+        """
+        Whether a split (default: every split) was compiled from the current source files
+
+        Only the split's own sources are stat'ed and compared by size/mtime. If
+        those changed (e.g. touched by a checkout) the contents are hashed, and
+        when they still match the compiled version the stamps are refreshed in
+        place. file_key follows that write, so open_artifact keeps this instance.
+        """
+        names = [split] if split is not None else list(self._split_sources)
+        stale = {}
+        for name in names:
+            sources, stamp, _ = self._split_sources[name]
+            current = source_stamp(dataset_dir, sources)
+            if current != stamp:
+                stale[name] = current
+        if not stale:
+            return True
+        if self.source_hash != source_hash(dataset_dir):
+            return False
+
+        try:
+            with open(self.artifact_file, 'r+b') as f:
+                # Only patch the file this instance maps, not one compiled over it since
+                if os.fstat(f.fileno()).st_ino != os.fstat(self._file.fileno()).st_ino:
+                    return True
+                for name, current in stale.items():
+                    f.seek(self._split_sources[name][2] + SPLIT_STAMP_OFFSET)
+                    f.write(current)
+                    self._split_sources[name][1] = current
+                f.flush()
+                self.file_key = _file_key(os.fstat(f.fileno()))
+        except OSError:
+            pass
+        return True
+
+
+def _file_key(stat: os.stat_result) -> Tuple[int, int]:
+    return stat.st_size, stat.st_mtime_ns
+
+
+_artifacts = {}
+
+
+def open_artifact(artifact_file: str) -> GroundTruthArtifact:
+    """
+    Shared, already-open artifact for a path; reopened when the file is recompiled
+    The replaced instance is closed: scenes already decoded from it stay valid,
+    but its SplitScenes must be loaded again.
+    """
+    artifact_file = os.path.abspath(artifact_file)
+    key = _file_key(os.stat(artifact_file))
+
+    cached = _artifacts.get(artifact_file)
+    if cached is None or cached.file_key != key:
+        if cached is not None:
+            cached.close()
+        cached = _artifacts[artifact_file] = GroundTruthArtifact(artifact_file)
+    return cached
+
+
+def load_compiled_metadata(metadata_file: str):
+    """
+    Scenes for a metadata file from the compiled artifact next to it
+    Returns: lazily decoded SplitScenes, or None if there is no up-to-date artifact for it
+    """
+    dataset_dir = os.path.dirname(metadata_file)
+    artifact_file = os.path.join(dataset_dir, ARTIFACT_NAME)
+    split = os.path.splitext(os.path.basename(metadata_file))[0]
+
+    if not os.path.exists(artifact_file):
+        return None
+
+    try:
+        artifact = open_artifact(artifact_file)
+    except ValueError as e:
+        print(f"Warning: {e}; re-run ground_truth.py (parsing JSON instead)")
+        return None
+    if split not in artifact.splits:
+        return None
+    if not artifact.is_fresh(dataset_dir, split):
+        print(f"Warning: {artifact_file} is out of date; re-run ground_truth.py (parsing JSON instead)")
+        return None
+
+    return artifact.load_split(split)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compile MultiRels metadata into a binary ground-truth artifact"
+    )
+
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default="dataset/MultiRels",
+        help="Dataset directory containing metadata.jsonl/valdata.jsonl and train/*/text.json"
+    )
+
+    parser.add_argument(
+        "--output_file",
+        type=str,
+        default=None,
+        help=f"Artifact path (defaults to <dataset_dir>/{ARTIFACT_NAME})"
+    )
+
+    args = parser.parse_args()
+    compile_ground_truth(args.dataset_dir, args.output_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Image discovery and loading for directories and archives
+Generated images can be read straight from .tar, .tar.gz/.tgz and .zip files without unpacking.
+Archive members are referenced as "<archive path>::<member name>".
+"""
+
+import io
+import os
+import glob
+import mmap
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import threading
+from typing import List
+
+from PIL import Image
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.JPG')
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.zip')
+MEMBER_SEPARATOR = "::"
+
+
+def is_archive(path: str) -> bool:
+    return path.endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def is_archive_member(image_ref: str) -> bool:
+    return MEMBER_SEPARATOR in image_ref
+
+
+def _is_image_member(name: str) -> bool:
+    """Image members, skipping macOS metadata (.DS_Store, __MACOSX/, ._ files)"""
+    base_name = os.path.basename(name)
+    if name.startswith("__MACOSX/") or base_name.startswith("._"):
+        return False
+    return base_name.endswith(IMAGE_EXTENSIONS)
+
+
+class ArchiveIndex:
+    """
+    Member index of one archive, built once
+
+    Uncompressed tars are memory-mapped and members are sliced out by offset;
+    zips seek straight to members via their central directory. Compressed
+    tars can't be seeked (reading backwards restarts decompression), so they
+    are decompressed once, in archive order, while the index is built: image
+    members go into an anonymous temp file that is memory-mapped like a tar.
+    That temp file needs as much free space (in TMPDIR) as the archive's
+    uncompressed images, on top of the archive itself; for large runs use a
+    .tar or .zip, which are read in place.
+    """
+
+    def __init__(self, archive_path: str):
+        self.archive_path = archive_path
+        self._lock = threading.Lock()
+
+        if archive_path.endswith('.zip'):
+            self._zip = zipfile.ZipFile(archive_path)
+            self.members = {
+                info.filename: info for info in self._zip.infolist()
+                if not info.is_dir() and _is_image_member(info.filename)
+            }
+        elif archive_path.endswith('.tar'):
+            self._file = open(archive_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            with tarfile.open(fileobj=self._mmap, mode='r:') as tar:
+                self.members = {
+                    member.name: (member.offset_data, member.size) for member in tar
+                    if member.isfile() and _is_image_member(member.name)
+                }
+        else:
+            self._file = tempfile.TemporaryFile()
+            self.members = {}
+            # Stream mode reads the archive strictly front to back
+            with tarfile.open(archive_path, mode='r|*') as tar:
+                for member in tar:
+                    if not (member.isfile() and _is_image_member(member.name)):
+                        continue
+                    self.members[member.name] = (self._file.tell(), member.size)
+                    shutil.copyfileobj(tar.extractfile(member), self._file)
+            self._file.flush()
+            # mmap can't map an empty file
+            self._mmap = b""
+            if self._file.tell() > 0:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, member_name: str) -> bytes:
+        member = self.members[member_name]
+
+        if self.archive_path.endswith('.zip'):
+            with self._lock:
+                return self._zip.read(member)
+        offset, size = member
+        return self._mmap[offset:offset + size]
+
+
+_archive_indexes = {}
+_archive_lock = threading.Lock()
+
+
+def get_archive_index(archive_path: str) -> ArchiveIndex:
+    """Member index for an archive (built on first use, then shared)"""
+    archive_path = os.path.abspath(archive_path)
+    with _archive_lock:
+        if archive_path not in _archive_indexes:
+            _archive_indexes[archive_path] = ArchiveIndex(archive_path)
+        return _archive_indexes[archive_path]
+
+
+def list_image_files(source: str, recursive: bool = False) -> List[str]:
+    """
+    Sorted image references in a directory or archive
+
+    Args:
+        source: Image directory, or a .tar/.tar.gz/.tgz/.zip archive
+        recursive: Also search subdirectories (archives are always searched fully)
+    """
+    if is_archive(source):
+        index = get_archive_index(source)
+        return sorted(f"{source}{MEMBER_SEPARATOR}{name}" for name in index.members)
+
+    image_files = []
+    for ext in IMAGE_EXTENSIONS:
+        pattern = os.path.join(source, '**', f'*{ext}') if recursive else os.path.join(source, f'*{ext}')
+        image_files.extend(glob.glob(pattern, recursive=recursive))
+
+    return sorted(set(image_files))
+
+
+def read_image_bytes(image_ref: str) -> bytes:
+    """Raw bytes of an image file or archive member"""
+    if is_archive_member(image_ref):
+        archive_path, member_name = image_ref.split(MEMBER_SEPARATOR, 1)
+        return get_archive_index(archive_path).read(member_name)
+
+    with open(image_ref, 'rb') as f:
+        return f.read()
+
+
+def open_image(image_ref: str) -> Image.Image:
+    """PIL image for an image file or archive member"""
+    if is_archive_member(image_ref):
+        return Image.open(io.BytesIO(read_image_bytes(image_ref)))
+    return Image.open(image_ref)
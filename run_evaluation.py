@@ -9,6 +9,9 @@ import argparse
 import json
 from pathlib import Path
 
+from ground_truth import ARTIFACT_NAME, load_compiled_metadata
+from image_sources import ARCHIVE_EXTENSIONS, MEMBER_SEPARATOR, is_archive, is_archive_member, list_image_files
+
 
 def setup_argparse():
     parser = argparse.ArgumentParser(
@@ -19,7 +22,9 @@ def setup_argparse():
         "--repo_dir",
         type=str,
         default=".",
-        help="Root directory of the eval repository"
+        help="Root directory of the eval repository. Method images may also be in .tar/.tar.gz/.zip "
+             "archives; a .tar.gz is decompressed to a temp file (under TMPDIR) as large as its images, "
+             "so use .tar or .zip for large runs"
     )
     
     parser.add_argument(
@@ -50,6 +55,103 @@ def setup_argparse():
         help="Delay between API calls (seconds)"
     )
     
+    parser.add_argument(
+        "--hedge_percentile",
+        type=float,
+        default=None,
+        help="Duplicate requests slower than this latency percentile (e.g. 95); disabled by default"
+    )
+    
+    parser.add_argument(
+        "--hedge_budget",
+        type=float,
+        default=0.1,
+        help="Maximum fraction of requests that may be hedged"
+    )
+    
+    parser.add_argument(
+        "--near_duplicate_threshold",
+        type=int,
+        default=None,
+        help="Reuse extractions for images whose perceptual hashes differ by at most this many bits (0-64)"
+    )
+    
+    parser.add_argument(
+        "--upload_images",
+        action="store_true",
+        help="Upload each image once via the File API and reference it by handle"
+    )
+    
+    parser.add_argument(
+        "--context_cache_ttl",
+        type=float,
+        default=None,
+        help="Cache the static prompt server-side for this many seconds (disabled by default)"
+    )
+    
+    parser.add_argument(
+        "--no_structured_output",
+        action="store_true",
+        help="Don't request schema-constrained JSON output from the model"
+    )
+    
+    parser.add_argument(
+        "--consistency_samples",
+        type=int,
+        default=1,
+        help="Maximum extraction samples per image for self-consistency (1 disables it)"
+    )
+    
+    parser.add_argument(
+        "--consistency_agreement",
+        type=int,
+        default=2,
+        help="Stop sampling an image once this many samples agree on the triple set"
+    )
+    
+    parser.add_argument(
+        "--cascade_model",
+        type=str,
+        default=None,
+        help="Query this cheaper model first (e.g. gemini-2.5-flash) and escalate only doubtful images"
+    )
+    
+    parser.add_argument(
+        "--token_budget",
+        type=int,
+        default=None,
+        help="Stop cleanly before total tokens would exceed this budget"
+    )
+    
+    parser.add_argument(
+        "--cost_budget",
+        type=float,
+        default=None,
+        help="Stop cleanly before the estimated cost (USD) would exceed this budget"
+    )
+    
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep per-image results from a previous (partial) run and evaluate only the rest"
+    )
+    
+    parser.add_argument(
+        "--ablation_models",
+        type=str,
+        nargs='+',
+        default=None,
+        help="Run an ablation over these Gemini models instead of a single comparison"
+    )
+    
+    parser.add_argument(
+        "--ablation_prompts",
+        type=str,
+        nargs='+',
+        default=None,
+        help="Prompt template files for the ablation ({object_list}/{predicate_list} placeholders)"
+    )
+    
     return parser
 
 
@@ -67,14 +169,21 @@ def scan_metadata_file(metadata_file: str):
     objects = set()
     predicates = set()
     
-    with open(metadata_file, 'r') as f:
-        for line in f:
-            if line.strip():
-                data = json.loads(line)
-                file_name = data['file_name']
-                scenes[file_name] = data
-                objects.update(data['objects'])
-                predicates.update(rel[1] for rel in data['relations'])
+    compiled = load_compiled_metadata(metadata_file)
+    if compiled is not None:
+        print(f"✓ Using compiled ground truth ({ARTIFACT_NAME})")
+        for data in compiled:
+            scenes[data['file_name']] = data
+        objects, predicates = compiled.vocabulary()
+    else:
+        with open(metadata_file, 'r') as f:
+            for line in f:
+                if line.strip():
+                    data = json.loads(line)
+                    file_name = data['file_name']
+                    scenes[file_name] = data
+                    objects.update(data['objects'])
+                    predicates.update(rel[1] for rel in data['relations'])
     
     print(f"✓ Metadata file: {metadata_file}")
     print(f"  Total scenes: {len(scenes)}")
@@ -90,6 +199,22 @@ def scan_metadata_file(metadata_file: str):
     return scenes
 
 
+def find_method_source(repo_dir: str, method_name: str):
+    """Image directory for a method, or an archive of it if the directory isn't unpacked"""
+    images_path = os.path.join(repo_dir, method_name, "images-30000/images-30000")
+    if os.path.exists(images_path):
+        return images_path
+    
+    # Archives of the run, e.g. gnn_run.tar.gz or gnn_run/images-30000.zip
+    for base in [os.path.join(repo_dir, method_name),
+                 os.path.join(repo_dir, method_name, "images-30000")]:
+        for ext in ARCHIVE_EXTENSIONS:
+            if is_archive(base + ext):
+                return base + ext
+    
+    return None
+
+
 def scan_repo_structure(repo_dir: str):
     """Scan and display repository structure"""
     print("\n" + "="*70)
@@ -98,43 +223,29 @@ def scan_repo_structure(repo_dir: str):
     
     methods_found = []
     
-    # Check for gnn_run
-    gnn_path = os.path.join(repo_dir, "gnn_run/images-30000/images-30000")
-    if os.path.exists(gnn_path):
+    for method_name in ["gnn_run", "repr_run"]:
+        images_path = find_method_source(repo_dir, method_name)
+        if images_path is None:
+            print(f"✗ {method_name} not found at "
+                  f"{os.path.join(repo_dir, method_name, 'images-30000/images-30000')} (or as an archive)")
+            continue
+        
         # Count images recursively
-        import glob
-        images = glob.glob(os.path.join(gnn_path, '**', '*.png'), recursive=True) + \
-                glob.glob(os.path.join(gnn_path, '**', '*.jpg'), recursive=True)
+        images = list_image_files(images_path, recursive=True)
         # Count scenes (subdirectories)
-        scenes = set(os.path.dirname(os.path.relpath(img, gnn_path)) for img in images)
-        
-        print(f"✓ gnn_run found: {len(scenes)} scenes, {len(images)} images")
-        methods_found.append({
-            'name': 'gnn_run',
-            'images_dir': gnn_path,
-            'scenes': len(scenes),
-            'images': len(images)
-        })
-    else:
-        print(f"✗ gnn_run not found at {gnn_path}")
-    
-    # Check for repr_run
-    repr_path = os.path.join(repo_dir, "repr_run/images-30000/images-30000")
-    if os.path.exists(repr_path):
-        import glob
-        images = glob.glob(os.path.join(repr_path, '**', '*.png'), recursive=True) + \
-                glob.glob(os.path.join(repr_path, '**', '*.jpg'), recursive=True)
-        scenes = set(os.path.dirname(os.path.relpath(img, repr_path)) for img in images)
+        scenes = set(
+            os.path.dirname(img.split(MEMBER_SEPARATOR, 1)[1] if is_archive_member(img)
+                            else os.path.relpath(img, images_path))
+            for img in images
+        )
         
-        print(f"✓ repr_run found: {len(scenes)} scenes, {len(images)} images")
+        print(f"✓ {method_name} found: {len(scenes)} scenes, {len(images)} images ({images_path})")
         methods_found.append({
-            'name': 'repr_run',
-            'images_dir': repr_path,
+            'name': method_name,
+            'images_dir': images_path,
             'scenes': len(scenes),
             'images': len(images)
         })
-    else:
-        print(f"✗ repr_run not found at {repr_path}")
     
     print("="*70 + "\n")
     
@@ -199,8 +310,15 @@ def generate_markdown_table(comparison: dict, output_file: str = None):
         relation_iou = metrics['relation_iou']
         n_images = metrics['n_images']
         
+        if metrics.get('partial'):
+            method_name += " (partial)"
+        
         md.append(f"| {method_name} | {sg_iou:.3f} | {entity_iou:.3f} | {relation_iou:.3f} | {n_images} |")
     
+    if any(metrics.get('partial') for metrics in comparison.values()):
+        md.append("\nPartial: evaluation stopped at the token/cost budget or some extractions failed "
+                  "(left out of the averages); rerun with --resume to complete.")
+    
     md_str = "\n".join(md)
     
     if output_file:
@@ -215,6 +333,11 @@ def main():
     parser = setup_argparse()
     args = parser.parse_args()
     
+    if args.consistency_samples < 1:
+        parser.error("--consistency_samples must be at least 1")
+    if args.consistency_samples > 1 and not 1 <= args.consistency_agreement <= args.consistency_samples:
+        parser.error("--consistency_agreement must be between 1 and --consistency_samples")
+    
     # Set API key
     if args.gemini_api_key:
         os.environ["GEMINI_API_KEY"] = args.gemini_api_key
@@ -241,6 +364,7 @@ def main():
         print("Expected structure:")
         print("  gnn_run/images-30000/images-30000/")
         print("  repr_run/images-30000/images-30000/")
+        print("  (or gnn_run.tar/.tar.gz/.zip, repr_run.tar/.tar.gz/.zip)")
         sys.exit(1)
     
     # Create output directory
@@ -253,8 +377,29 @@ def main():
     
     # Import here to avoid errors if API key not set
     from sg_adapter_eval import SGAdapterEvaluator
-    
-    evaluator = SGAdapterEvaluator()
+    from gemini_cache import FileUploadCache, PromptContextCache
+    
+    upload_cache = None
+    if args.upload_images:
+        upload_cache = FileUploadCache(os.path.join(args.output_dir, "uploaded_files.json"))
+    
+    context_cache = None
+    if args.context_cache_ttl:
+        context_cache = PromptContextCache(ttl=args.context_cache_ttl)
+    
+    evaluator = SGAdapterEvaluator(
+        hedge_percentile=args.hedge_percentile,
+        hedge_budget=args.hedge_budget,
+        near_duplicate_threshold=args.near_duplicate_threshold,
+        upload_cache=upload_cache,
+        structured_output=not args.no_structured_output,
+        consistency_samples=args.consistency_samples,
+        consistency_agreement=args.consistency_agreement,
+        context_cache=context_cache,
+        token_budget=args.token_budget,
+        cost_budget=args.cost_budget,
+        cascade_model=args.cascade_model
+    )
     
     # Prepare methods config
     methods_config = [
@@ -265,12 +410,38 @@ def main():
         for m in methods_found
     ]
     
+    if args.ablation_models or args.ablation_prompts:
+        from sg_adapter_eval import DEFAULT_PROMPT_TEMPLATE
+        
+        prompt_templates = {"default": DEFAULT_PROMPT_TEMPLATE}
+        if args.ablation_prompts:
+            prompt_templates = {
+                Path(prompt_file).stem: Path(prompt_file).read_text()
+                for prompt_file in args.ablation_prompts
+            }
+        
+        evaluator.run_ablation(
+            prompt_templates=prompt_templates,
+            model_names=args.ablation_models or [evaluator.model_name],
+            methods_config=methods_config,
+            metadata_file=metadata_path,
+            output_dir=os.path.join(args.output_dir, "ablation")
+        )
+        if context_cache is not None:
+            context_cache.clear()
+        return
+    
     comparison = evaluator.compare_methods(
         methods_config=methods_config,
         metadata_file=metadata_path,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        resume=args.resume
     )
     
+    # Cached prompts are billed for storage until they expire
+    if context_cache is not None:
+        context_cache.clear()
+    
     # Generate tables
     print("\n" + "="*70)
     print("GENERATING TABLES")
@@ -288,6 +459,8 @@ def main():
         "methods_evaluated": list(comparison.keys()),
         "num_methods": len(comparison),
         "num_test_scenes": len(scenes),
+        "partial": any(metrics.get('partial') for metrics in comparison.values()),
+        "usage": evaluator.usage,
         "metrics": comparison
     }
     
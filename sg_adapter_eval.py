@@ -6,30 +6,475 @@ UPDATED: Filters out reference images (e.g., 000.png), keeping only generated va
 
 import os
 import json
-import glob
+import hashlib
+import threading
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, TypedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import google.generativeai as genai
-from PIL import Image
 import time
 
+from gemini_cache import FileUploadCache, PromptContextCache, is_missing_resource_error
+from image_sources import list_image_files, open_image, read_image_bytes
+from ground_truth import load_compiled_metadata
+
 # Configure Gemini API
 genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
 
+# Extraction prompt; {object_list} and {predicate_list} are filled from the metadata vocabulary
+DEFAULT_PROMPT_TEMPLATE = """Please extract the scene graph of the given image. The scene graph should include the relations of the salient objects.
+
+The objects should be selected from this list: {object_list}
+
+The predicates/relations should be selected from this list: {predicate_list}
+
+Output ONLY a valid JSON object with this exact format:
+{{
+    "scene_graph": [["subject1", "predicate1", "object1"], ["subject2", "predicate2", "object2"]],
+    "entities": ["entity1", "entity2", "entity3"]
+}}
+
+Do not include any other text, explanations, or markdown formatting."""
+
+
+# Approximate USD per 1M (input, output) tokens, used for cost budgets
+TOKEN_PRICES = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+
+# Prompt tokens served from cached content are billed at this fraction of the input price
+CACHED_INPUT_PRICE_FACTOR = 0.25
+
+# Input tokens billed per image
+IMAGE_TOKENS = 258
+
+# Output (incl. thinking) tokens assumed per request before any usage is observed
+EXPECTED_OUTPUT_TOKENS = 1000
+
+
+# Population count for Hamming distances (int.bit_count needs Python 3.10+)
+_popcount = getattr(int, "bit_count", lambda value: bin(value).count("1"))
+
+
+class SceneGraphResponse(TypedDict):
+    """Response schema used for structured (JSON mode) output"""
+    scene_graph: List[List[str]]
+    entities: List[str]
+
+
+def _close_json(text: str) -> str:
+    """
+    Normalize almost-JSON: single-quoted strings become double-quoted,
+    trailing commas are dropped, text after the top-level value is ignored
+    and unterminated arrays/objects are closed. A string cut off mid-way is
+    dropped rather than closed, so half-written names never become values.
+    """
+    out = []
+    stack = []
+    quote = None
+    string_start = 0
+    escape = False
+    
+    def strip_trailing_comma():
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ',':
+            out.pop()
+    
+    for ch in text:
+        if quote is not None:
+            if escape:
+                escape = False
+                out.append(ch)
+            elif ch == '\\':
+                escape = True
+                out.append(ch)
+            elif ch == quote:
+                quote = None
+                out.append('"')
+            elif ch == '"':
+                # Double quote inside a single-quoted string
+                out.append('\\"')
+            else:
+                out.append(ch)
+            continue
+        
+        if ch in '"\'':
+            quote = ch
+            string_start = len(out)
+            out.append('"')
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            if not stack:
+                break
+            strip_trailing_comma()
+            out.append(stack.pop())
+            if not stack:
+                # End of the top-level value; ignore trailing text
+                break
+        else:
+            out.append(ch)
+    
+    # Truncated response: drop an unfinished string, close whatever is still open
+    if quote is not None:
+        del out[string_start:]
+    while stack:
+        strip_trailing_comma()
+        out.append(stack.pop())
+    
+    return "".join(out)
+
+
+def parse_scene_graph_response(response_text: str) -> Tuple[Dict, bool]:
+    """
+    Parse a model response into {"scene_graph": [...], "entities": [...]}
+    
+    Tries plain JSON first, then repairs common defects (markdown fences,
+    surrounding text, single quotes, trailing commas, truncation).
+    Returns: (result, repaired) - repaired is True if the fast path failed
+    Raises: ValueError if the response can't be recovered
+    """
+    text = response_text.strip()
+    
+    # Fast path: well-formed JSON
+    try:
+        result = json.loads(text)
+        repaired = False
+    except ValueError:
+        result = None
+        repaired = True
+    
+    if result is None:
+        # Remove markdown code blocks if present
+        if "```" in text:
+            text = text.split("```")[1]
+            if text.startswith("json"):
+                text = text[4:]
+        
+        start = text.find("{")
+        if start < 0:
+            raise ValueError("No JSON object in response")
+        text = text[start:]
+        
+        # On a truncated response, drop the incomplete last element and retry
+        while result is None:
+            try:
+                result = json.loads(_close_json(text))
+            except ValueError:
+                cut = text.rfind(",")
+                if cut <= 0:
+                    raise ValueError("Unrecoverable JSON response")
+                text = text[:cut]
+    
+    if not isinstance(result, dict) or not isinstance(result.get("scene_graph"), list):
+        raise ValueError("Invalid response structure")
+    
+    scene_graph = [
+        [str(item) for item in triple] for triple in result["scene_graph"]
+        if isinstance(triple, list) and len(triple) == 3
+    ]
+    entities = result.get("entities")
+    if not isinstance(entities, list):
+        # Entities were lost (e.g. truncated); recover them from the triples
+        entities = list(dict.fromkeys([t[0] for t in scene_graph] + [t[2] for t in scene_graph]))
+        repaired = True
+    
+    if len(scene_graph) != len(result["scene_graph"]):
+        repaired = True
+    
+    return {"scene_graph": scene_graph, "entities": [str(e) for e in entities]}, repaired
+
+
 class SGAdapterEvaluator:
-    def __init__(self, model_name="gemini-2.5-pro"):
-        """Initialize the evaluator with Gemini model"""
-        self.model = genai.GenerativeModel(model_name)
+    def __init__(self,
+                 model_name="gemini-2.5-pro",
+                 hedge_percentile: float = None,
+                 hedge_budget: float = 0.1,
+                 hedge_min_samples: int = 10,
+                 near_duplicate_threshold: int = None,
+                 upload_cache: FileUploadCache = None,
+                 prompt_template: str = DEFAULT_PROMPT_TEMPLATE,
+                 structured_output: bool = True,
+                 max_parse_retries: int = 2,
+                 consistency_samples: int = 1,
+                 consistency_agreement: int = 2,
+                 context_cache: PromptContextCache = None,
+                 token_budget: int = None,
+                 cost_budget: float = None,
+                 token_prices: Dict[str, Tuple[float, float]] = None,
+                 cascade_model: str = None,
+                 model_factory=None):
+        """
+        Initialize the evaluator with Gemini model
+        
+        Args:
+            model_name: Gemini model used for scene graph extraction
+            hedge_percentile: If set (e.g. 95), a request still running after this
+                percentile of the model's observed latencies is duplicated and the first
+                response wins. None disables hedging.
+            hedge_budget: Maximum fraction of requests that may be hedged
+            hedge_min_samples: Number of observed latencies of a model needed before its requests are hedged
+            near_duplicate_threshold: If set, images whose perceptual hashes differ
+                by at most this many bits (out of 64) reuse an earlier extraction.
+                None only reuses byte-identical images.
+            upload_cache: If set, images are uploaded once through the File API
+                and referenced by handle instead of being sent inline
+            prompt_template: Extraction prompt with {object_list} and {predicate_list} placeholders
+            structured_output: Request JSON output constrained to the scene graph
+                schema; models that reject it fall back to plain text
+            max_parse_retries: How many times an unparseable response is re-requested
+            consistency_samples: Maximum extractions sampled per image (k). With
+                k > 1, sampling stops early once consistency_agreement samples
+                agree on the triple set; 1 disables self-consistency.
+            consistency_agreement: Number of agreeing samples needed to stop (m, 1 <= m <= k)
+            context_cache: If set, the static prompt is stored as server-side
+                cached content once per run and referenced by every request
+            token_budget: Stop evaluating before total tokens would exceed this
+            cost_budget: Stop evaluating before estimated cost (USD) would exceed this
+            token_prices: Overrides for TOKEN_PRICES (model -> USD per 1M input/output tokens)
+            cascade_model: If set (e.g. "gemini-2.5-flash"), each image is first
+                extracted by this cheaper model and only escalated to model_name
+                when the answer is invalid, out of vocabulary or inconsistent
+            model_factory: Builds a model client from a model name (defaults to
+                genai.GenerativeModel); pass a local stand-in to run without the API
+        """
+        self.model_factory = model_factory or genai.GenerativeModel
+        self._models = {}
+        self.use_model(model_name)
+        self.prompt_template = prompt_template
         
         # These will be extracted from metadata
         self.object_list = set()
         self.predicate_list = set()
+        
+        # Request hedging (tail latency)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = {}  # model name -> observed latencies
+        self.reset_run_stats()
+        
+        # Extraction coalescing: (content hash, model, prompt) -> Future
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self._lock = threading.Lock()
+        self._extractions = {}
+        self._extraction_sources = {}
+        self._disk_cached = set()
+        self._content_hashes = {}
+        self._perceptual_hashes = []
+        
+        self.upload_cache = upload_cache
+        self.context_cache = context_cache
+        
+        # Token/cost budget; usage accumulates over the evaluator's lifetime
+        self.token_budget = token_budget
+        self.cost_budget = cost_budget
+        self.token_prices = dict(TOKEN_PRICES)
+        self.token_prices.update(token_prices or {})
+        self.usage = {"prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0, "tokens": 0, "cost": 0.0}
+        self._image_usage = []
+        
+        self.cascade_model = cascade_model
+        
+        # Structured output / response parsing
+        self.structured_output = structured_output
+        self.max_parse_retries = max_parse_retries
+        self._schema_unsupported = set()
+        
+        # Self-consistency sampling
+        if consistency_samples < 1:
+            raise ValueError(f"consistency_samples must be at least 1, got {consistency_samples}")
+        if consistency_samples > 1 and not 1 <= consistency_agreement <= consistency_samples:
+            raise ValueError(f"consistency_agreement must be between 1 and consistency_samples "
+                             f"({consistency_samples}), got {consistency_agreement}")
+        self.consistency_samples = consistency_samples
+        self.consistency_agreement = consistency_agreement
+    
+    def _get_model(self, model_name: str):
+        """Model client for a model name, created once"""
+        if model_name not in self._models:
+            self._models[model_name] = self.model_factory(model_name)
+        return self._models[model_name]
+    
+    def use_model(self, model_name: str):
+        """Switch the extraction model, reusing previously created model clients"""
+        self.model_name = model_name
+        self.model = self._get_model(model_name)
+    
+    def _model_key(self) -> str:
+        """Identifies the model setup in extraction cache keys"""
+        if self.cascade_model is None:
+            return self.model_name
+        return f"{self.cascade_model}>{self.model_name}"
+    
+    def reset_run_stats(self):
+        """Reset the per-run request counters"""
+        self.run_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0,
+                          "coalesced": 0, "near_duplicates": 0, "cache_hits": 0,
+                          "parse_repairs": 0, "parse_retries": 0,
+                          "consistency_images": 0, "consistency_samples": 0, "consistency_failed_samples": 0,
+                          "contested_images": 0, "cached_context_requests": 0}
+    
+    def get_run_stats(self, run_stats: Dict = None) -> Dict:
+        """Return request counters (the current run's by default) together with derived rates"""
+        stats = dict(self.run_stats if run_stats is None else run_stats)
+        requests = stats["requests"]
+        stats["hedge_rate"] = stats["hedged"] / requests if requests > 0 else 0
+        stats["hedge_win_rate"] = stats["hedge_wins"] / stats["hedged"] if stats["hedged"] > 0 else 0
+        if stats["consistency_images"] > 0:
+            stats["mean_samples_per_image"] = stats["consistency_samples"] / stats["consistency_images"]
+            # Failed draws cost a call too
+            stats["mean_draws_per_image"] = (
+                (stats["consistency_samples"] + stats["consistency_failed_samples"]) / stats["consistency_images"]
+            )
+            stats["contested_rate"] = stats["contested_images"] / stats["consistency_images"]
+        return stats
+    
+    def _prices(self, model_name: str) -> Tuple[float, float]:
+        """USD per 1M (input, output) tokens; unknown models are priced like gemini-2.5-pro"""
+        model_name = model_name.split("/")[-1]
+        return self.token_prices.get(model_name, self.token_prices["gemini-2.5-pro"])
+    
+    def _record_usage(self, response, model):
+        """Add a response's reported token usage to the running totals"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        
+        # prompt_token_count includes the part of the prompt served from cached content
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        cached_tokens = min(getattr(usage, "cached_content_token_count", 0) or 0, prompt_tokens)
+        # Thinking tokens are billed as output
+        output_tokens = ((getattr(usage, "candidates_token_count", 0) or 0) +
+                         (getattr(usage, "thoughts_token_count", 0) or 0))
+        price_in, price_out = self._prices(getattr(model, "model_name", self.model_name))
+        input_cost = price_in * (prompt_tokens - cached_tokens + cached_tokens * CACHED_INPUT_PRICE_FACTOR)
+        
+        with self._lock:
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["cached_tokens"] += cached_tokens
+            self.usage["output_tokens"] += output_tokens
+            self.usage["tokens"] += prompt_tokens + output_tokens
+            self.usage["cost"] += (input_cost + output_tokens * price_out) / 1e6
+    
+    def estimate_image_usage(self) -> Tuple[float, float]:
+        """
+        Expected (tokens, cost) of evaluating the next image
+        Uses the mean over images evaluated so far, or a prior from the prompt size before that
+        """
+        if self._image_usage:
+            n = len(self._image_usage)
+            return (sum(tokens for tokens, _ in self._image_usage) / n,
+                    sum(cost for _, cost in self._image_usage) / n)
+        
+        # ~4 characters per token for the prompt text
+        prompt_tokens = len(self.build_prompt()) / 4 + IMAGE_TOKENS
+        price_in, price_out = self._prices(self.model_name)
+        requests = self.consistency_agreement if self.consistency_samples > 1 else 1
+        tokens = requests * (prompt_tokens + EXPECTED_OUTPUT_TOKENS)
+        cost = requests * (prompt_tokens * price_in + EXPECTED_OUTPUT_TOKENS * price_out) / 1e6
+        return tokens, cost
+    
+    def within_budget(self) -> bool:
+        """Whether the next image is expected to fit in the remaining token/cost budget"""
+        if self.token_budget is None and self.cost_budget is None:
+            return True
+        
+        tokens, cost = self.estimate_image_usage()
+        if self.token_budget is not None and self.usage["tokens"] + tokens > self.token_budget:
+            return False
+        if self.cost_budget is not None and self.usage["cost"] + cost > self.cost_budget:
+            return False
+        return True
+    
+    def _hedge_threshold(self, model_name: str):
+        """Latency (seconds) after which a request to model_name gets hedged, or None if hedging is off"""
+        latencies = self.latencies.get(model_name, [])
+        if self.hedge_percentile is None or len(latencies) < self.hedge_min_samples:
+            return None
+        if self.run_stats["hedged"] + 1 > self.hedge_budget * self.run_stats["requests"]:
+            return None
+        
+        ordered = sorted(latencies)
+        rank = int(round(self.hedge_percentile / 100 * (len(ordered) - 1)))
+        return ordered[min(max(rank, 0), len(ordered) - 1)]
+    
+    def _generate(self, contents, model=None, **kwargs):
+        """
+        Call generate_content, duplicating the request if it is slower than
+        the hedge threshold and returning whichever response arrives first
+        """
+        if model is None:
+            model = self.model
+        self.run_stats["requests"] += 1
+        # Latencies are tracked per model; cascade models differ a lot in speed
+        model_name = getattr(model, "model_name", self.model_name).split("/")[-1]
+        latencies = self.latencies.setdefault(model_name, [])
+        threshold = self._hedge_threshold(model_name)
+        start = time.time()
+        
+        if threshold is None:
+            response = model.generate_content(contents, **kwargs)
+            latencies.append(time.time() - start)
+            self._record_usage(response, model)
+            return response
+        
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            primary = executor.submit(model.generate_content, contents, **kwargs)
+            done, _ = wait([primary], timeout=threshold)
+            if done:
+                response = primary.result()
+                latencies.append(time.time() - start)
+                self._record_usage(response, model)
+                return response
+            
+            self.run_stats["hedged"] += 1
+            hedge = executor.submit(model.generate_content, contents, **kwargs)
+            
+            def record_usage(finished):
+                if finished.exception() is None:
+                    self._record_usage(finished.result(), model)
+            
+            # Take the first successful response; only fail if both fail
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is hedge:
+                            self.run_stats["hedge_wins"] += 1
+                        latencies.append(time.time() - start)
+                        self._record_usage(future.result(), model)
+                        # The losing request is billed too; count it once it finishes
+                        for loser in {primary, hedge} - {future}:
+                            loser.add_done_callback(record_usage)
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            # Don't block on the losing request
+            executor.shutdown(wait=False)
     
     def load_metadata(self, metadata_file: str) -> List[Dict]:
         """
         Load metadata from JSONL file
+        Uses the compiled artifact next to it (see ground_truth.py) when it is up to date
         Returns: list of metadata dicts (preserving order)
         """
+        metadata_list = load_compiled_metadata(metadata_file)
+        if metadata_list is not None:
+            # Scenes are decoded on access; the vocabulary comes straight from the index
+            objects, predicates = metadata_list.vocabulary()
+            self.object_list.update(objects)
+            self.predicate_list.update(predicates)
+            return metadata_list
+        
         metadata_list = []
         
         with open(metadata_file, 'r') as f:
@@ -70,49 +515,367 @@ class SGAdapterEvaluator:
         
         return metadata_list
     
-    def extract_scene_graph_from_image(self, image_path: str) -> Dict:
-        """Extract scene graph from image using Gemini"""
+    def build_prompt(self) -> str:
+        """Build the extraction prompt from the current object/predicate vocabulary"""
         
         # Convert sets to sorted lists for prompt
         object_list = sorted(list(self.object_list))
         predicate_list = sorted(list(self.predicate_list))
         
-        prompt = f"""Please extract the scene graph of the given image. The scene graph should include the relations of the salient objects.
-
-The objects should be selected from this list: {object_list}
-
-The predicates/relations should be selected from this list: {predicate_list}
-
-Output ONLY a valid JSON object with this exact format:
-{{
-    "scene_graph": [["subject1", "predicate1", "object1"], ["subject2", "predicate2", "object2"]],
-    "entities": ["entity1", "entity2", "entity3"]
-}}
-
-Do not include any other text, explanations, or markdown formatting."""
-
+        return self.prompt_template.format(
+            object_list=object_list,
+            predicate_list=predicate_list
+        )
+    
+    def _content_hash(self, image_path: str) -> str:
+        """SHA-256 of the image file contents (memoized per path)"""
+        if image_path not in self._content_hashes:
+            self._content_hashes[image_path] = hashlib.sha256(read_image_bytes(image_path)).hexdigest()
+        return self._content_hashes[image_path]
+    
+    @staticmethod
+    def perceptual_hash(img) -> int:
+        """64-bit difference hash (dHash) of a PIL image"""
+        pixels = list(img.convert("L").resize((9, 8)).getdata())
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                left = pixels[row * 9 + col]
+                right = pixels[row * 9 + col + 1]
+                bits = (bits << 1) | (1 if left > right else 0)
+        return bits
+    
+    def _find_near_duplicate(self, phash: int, request_key: Tuple):
+        """Return the cache key of the closest previous extraction within the near-duplicate threshold"""
+        best_key = None
+        best_distance = self.near_duplicate_threshold + 1
+        for other_hash, other_key in self._perceptual_hashes:
+            if other_key[1:] != request_key[1:]:
+                continue
+            distance = _popcount(phash ^ other_hash)
+            if distance < best_distance:
+                best_key, best_distance = other_key, distance
+                if distance == 0:
+                    break
+        return best_key
+    
+    @staticmethod
+    def _as_reused(result: Dict, source: str, reuse_type: str) -> Dict:
+        """Copy of a cached extraction marked with where it was reused from"""
+        reused = {"scene_graph": result["scene_graph"], "entities": result["entities"]}
+        reused["reused_from"] = source
+        reused["reuse_type"] = reuse_type
+        return reused
+    
+    @staticmethod
+    def _is_schema_error(error: Exception) -> bool:
+        """Whether a request was rejected because of response_schema/response_mime_type"""
+        if not isinstance(error, (TypeError, ValueError)) and type(error).__name__ != "InvalidArgument":
+            return False
+        message = str(error).lower().replace("_", "")
+        return "responseschema" in message or "responsemimetype" in message
+    
+    def _generate_structured(self, contents, model_name: str, model=None):
+        """Generate with the JSON response schema when the model supports it"""
+        if model is None:
+            model = self._get_model(model_name)
+        if not self.structured_output or model_name in self._schema_unsupported:
+            return self._generate(contents, model)
+        
         try:
-            img = Image.open(image_path)
-            response = self.model.generate_content([prompt, img])
+            generation_config = genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=SceneGraphResponse
+            )
+            return self._generate(contents, model, generation_config=generation_config)
+        except Exception as e:
+            # Older SDKs/models reject response_schema; remember and fall back.
+            # Other failures (stale file handle, rate limit, ...) aren't about the schema.
+            if not self._is_schema_error(e):
+                raise
+            print(f"Structured output not available for {model_name}, using plain text: {e}")
+        
+        self._schema_unsupported.add(model_name)
+        return self._generate(contents, model)
+    
+    def _send_extraction_request(self, image_part, prompt: str, model_name: str):
+        """Send prompt and image, referencing the cached prompt when context caching is on"""
+        if self.context_cache is not None:
+            cached_model = self.context_cache.get_model(model_name, prompt)
+            if cached_model is not None:
+                try:
+                    response = self._generate_structured([image_part], model_name, cached_model)
+                    self.run_stats["cached_context_requests"] += 1
+                    return response
+                except Exception as e:
+                    # Only an expired/deleted entry is replaced; rate limits,
+                    # timeouts etc. take the normal error path
+                    if not is_missing_resource_error(e, "cachedcontent"):
+                        raise
+                    print(f"Cached prompt is gone, sending full prompt: {e}")
+                    self.context_cache.invalidate(model_name, prompt)
+        
+        return self._generate_structured([prompt, image_part], model_name)
+    
+    def _request_extraction(self, image_part, prompt: str, model_name: str, max_parse_retries: int) -> Dict:
+        """
+        Send one extraction request and parse the JSON response
+        Only responses the tolerant parser can't recover are re-requested
+        """
+        for attempt in range(max_parse_retries + 1):
+            response = self._send_extraction_request(image_part, prompt, model_name)
             
-            response_text = response.text.strip()
-            # Remove markdown code blocks if present
-            if response_text.startswith("```"):
-                response_text = response_text.split("```")[1]
-                if response_text.startswith("json"):
-                    response_text = response_text[4:]
-                response_text = response_text.strip()
+            try:
+                result, repaired = parse_scene_graph_response(response.text)
+            except ValueError as e:
+                if attempt == max_parse_retries:
+                    raise
+                print(f"Unparseable response ({e}), re-requesting")
+                self.run_stats["parse_retries"] += 1
+                continue
+            
+            if repaired:
+                self.run_stats["parse_repairs"] += 1
+            return result
+    
+    def _request_with_upload(self,
+                             image_path: str,
+                             img,
+                             content_hash: str,
+                             prompt: str,
+                             model_name: str = None,
+                             max_parse_retries: int = None) -> Dict:
+        """Request an extraction referencing the uploaded file, falling back to inline bytes"""
+        if model_name is None:
+            model_name = self.model_name
+        if max_parse_retries is None:
+            max_parse_retries = self.max_parse_retries
+        
+        image_part = None
+        if self.upload_cache is not None:
+            image_part = self.upload_cache.get_part(image_path, content_hash)
+        
+        if image_part is None:
+            return self._request_extraction(img, prompt, model_name, max_parse_retries)
+        
+        try:
+            return self._request_extraction(image_part, prompt, model_name, max_parse_retries)
+        except Exception as e:
+            # Only a deleted/expired handle is dropped; rate limits, timeouts
+            # and unparseable responses keep the upload and fail as usual
+            if not is_missing_resource_error(e, "file"):
+                raise
+            print(f"Uploaded file for {image_path} is gone, retrying inline: {e}")
+            self.upload_cache.invalidate(content_hash)
+            return self._request_extraction(img, prompt, model_name, max_parse_retries)
+    
+    def _out_of_vocabulary(self, extracted: Dict) -> bool:
+        """Whether an extraction uses objects or predicates outside the metadata vocabulary"""
+        for subject, predicate, obj in extracted["scene_graph"]:
+            if subject not in self.object_list or obj not in self.object_list:
+                return True
+            if predicate not in self.predicate_list:
+                return True
+        return any(entity not in self.object_list for entity in extracted["entities"])
+    
+    def _request_cascade(self, image_path: str, img, content_hash: str, prompt: str) -> Dict:
+        """
+        Ask the cheap cascade model first (two samples) and escalate to the main
+        model if a response is invalid, uses out-of-vocabulary terms, or the two
+        samples disagree on the triple set
+        """
+        reason = None
+        samples = []
+        for _ in range(2):
+            try:
+                extracted = self._request_with_upload(
+                    image_path, img, content_hash, prompt,
+                    model_name=self.cascade_model, max_parse_retries=0
+                )
+            except ValueError:
+                reason = "invalid"
+            except Exception as e:
+                print(f"Cascade model failed for {image_path}: {e}")
+                reason = "error"
+            else:
+                if self._out_of_vocabulary(extracted):
+                    reason = "out_of_vocabulary"
+                samples.append(extracted)
+            if reason is not None:
+                break
+        
+        if reason is None:
+            first, second = samples
+            if ({tuple(triple) for triple in first["scene_graph"]} !=
+                    {tuple(triple) for triple in second["scene_graph"]}):
+                reason = "disagreement"
+        
+        if reason is None:
+            result = dict(samples[0])
+            result["cascade"] = {"model": self.cascade_model, "escalated": False}
+            return result
+        
+        result = dict(self._request_with_upload(image_path, img, content_hash, prompt))
+        result["cascade"] = {"model": self.model_name, "escalated": True, "reason": reason}
+        return result
+    
+    def extract_scene_graph_from_image(self, image_path: str, sample: int = 0) -> Dict:
+        """
+        Extract scene graph from image using Gemini
+        
+        Identical images (same content hash, prompt and model) share a single
+        request, including requests that are still in flight. With
+        near_duplicate_threshold set, perceptually similar images reuse an
+        earlier extraction. Reused results carry 'reused_from' and 'reuse_type'
+        ('exact', 'near_duplicate', or 'cache' for hits seeded by load_extractions).
+
+        Args:
+            image_path: Image to extract from
+            sample: Sample index; different indices are independent requests
+        """
+        prompt = self.build_prompt()
+        
+        try:
+            key = (self._content_hash(image_path), self._model_key(), prompt, sample)
             
-            result = json.loads(response_text)
+            # Single-flight: the first caller for a key makes the request,
+            # everyone else waits on its future
+            with self._lock:
+                future = self._extractions.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._extractions[key] = future
+                    self._extraction_sources[key] = image_path
             
-            if "scene_graph" not in result or "entities" not in result:
-                raise ValueError("Invalid response structure")
+            if not owner:
+                result = future.result()
+                # Seeded by load_extractions (no request was shared) or coalesced
+                reuse_type = "cache" if key in self._disk_cached else "exact"
+                with self._lock:
+                    self.run_stats["cache_hits" if reuse_type == "cache" else "coalesced"] += 1
+                return self._as_reused(result, self._extraction_sources[key], reuse_type)
             
-            return result
+            try:
+                img = open_image(image_path)
+                
+                duplicate_key = None
+                if self.near_duplicate_threshold is not None:
+                    phash = self.perceptual_hash(img)
+                    with self._lock:
+                        duplicate_key = self._find_near_duplicate(phash, key)
+                        self._perceptual_hashes.append((phash, key))
+                
+                if duplicate_key is not None:
+                    result = self._extractions[duplicate_key].result()
+                    with self._lock:
+                        self.run_stats["near_duplicates"] += 1
+                    future.set_result(result)
+                    return self._as_reused(result, self._extraction_sources[duplicate_key], "near_duplicate")
+                
+                if self.cascade_model is not None:
+                    result = self._request_cascade(image_path, img, key[0], prompt)
+                else:
+                    result = self._request_with_upload(image_path, img, key[0], prompt)
+                future.set_result(result)
+                return result
+            except Exception as e:
+                # Don't cache failures; let the next caller retry
+                with self._lock:
+                    self._extractions.pop(key, None)
+                    self._perceptual_hashes = [
+                        entry for entry in self._perceptual_hashes if entry[1] != key
+                    ]
+                future.set_exception(e)
+                raise
             
         except Exception as e:
             print(f"Error processing {image_path}: {e}")
-            return {"scene_graph": [], "entities": []}
+            return {"scene_graph": [], "entities": [], "error": str(e)}
+    
+    def prepare_images(self, images: List[Tuple[str, int]]):
+        """Hash (and upload, if enabled) every image once ahead of evaluation"""
+        for img_path, _ in images:
+            content_hash = self._content_hash(img_path)
+            if self.upload_cache is not None:
+                self.upload_cache.get_part(img_path, content_hash)
+    
+    @staticmethod
+    def _extraction_cache_key(content_hash: str, model_key: str, prompt_hash: str, sample: int) -> str:
+        return f"{model_key}/{prompt_hash[:16]}/{content_hash}#{sample}"
+    
+    def load_extractions(self, cache_file: str) -> int:
+        """
+        Seed the extraction cache from a JSON file
+        Only entries recorded for the current model setup and prompt (compared
+        by SHA-256, so an edited template or a different vocabulary misses) are used.
+        Returns: number of cached extractions loaded
+        """
+        if not os.path.exists(cache_file):
+            return 0
+        
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+        
+        prompt = self.build_prompt()
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        model_key = self._model_key()
+        
+        loaded = 0
+        with self._lock:
+            for entry in cached.values():
+                if entry.get("model") != model_key or entry.get("prompt_sha256") != prompt_hash:
+                    continue
+                key = (entry["content_hash"], model_key, prompt, entry["sample"])
+                if key in self._extractions:
+                    continue
+                future = Future()
+                future.set_result({"scene_graph": entry["scene_graph"], "entities": entry["entities"]})
+                self._extractions[key] = future
+                self._extraction_sources[key] = entry["image"]
+                self._disk_cached.add(key)
+                loaded += 1
+        
+        return loaded
+    
+    def save_extractions(self, cache_file: str):
+        """
+        Write completed extractions for the current model and prompt to a JSON file
+        Entries for other models/prompts already in the file are kept.
+        """
+        prompt = self.build_prompt()
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        model_key = self._model_key()
+        with self._lock:
+            items = list(self._extractions.items())
+        
+        cached = {}
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                cached = {
+                    cache_key: entry for cache_key, entry in json.load(f).items()
+                    if "prompt_sha256" in entry
+                }
+        
+        for key, future in items:
+            if key[1:3] != (model_key, prompt):
+                continue
+            if not future.done() or future.exception() is not None:
+                continue
+            result = future.result()
+            content_hash, sample = key[0], key[3]
+            cached[self._extraction_cache_key(content_hash, model_key, prompt_hash, sample)] = {
+                "image": self._extraction_sources[key],
+                "content_hash": content_hash,
+                "model": model_key,
+                "prompt_sha256": prompt_hash,
+                "sample": sample,
+                "scene_graph": result["scene_graph"],
+                "entities": result["entities"]
+            }
+        
+        with open(cache_file, 'w') as f:
+            json.dump(cached, f, indent=2)
     
     def compute_iou(self, list1: List, list2: List) -> float:
         """Compute Intersection over Union (IoU) for two lists"""
@@ -134,9 +897,67 @@ Do not include any other text, explanations, or markdown formatting."""
         
         return intersection / union if union > 0 else 0.0
     
+    def extract_consistent_scene_graph(self, image_path: str) -> Tuple[Dict, Dict]:
+        """
+        Sample extractions one at a time until consistency_agreement samples
+        produce the same triple set, or consistency_samples have been drawn.
+        Failed requests use up a draw but don't vote.
+        Returns: (extraction for the majority triple set, agreement stats)
+        """
+        samples = []
+        votes = {}
+        failed = 0
+        
+        for sample in range(self.consistency_samples):
+            extracted = self.extract_scene_graph_from_image(image_path, sample=sample)
+            if "error" in extracted:
+                failed += 1
+                last_error = extracted
+            else:
+                triple_set = frozenset(tuple(triple) for triple in extracted["scene_graph"])
+                samples.append((triple_set, extracted))
+                votes[triple_set] = votes.get(triple_set, 0) + 1
+                
+                if votes[triple_set] >= self.consistency_agreement:
+                    break
+            # Stop if no triple set can still reach the agreement threshold
+            remaining = self.consistency_samples - sample - 1
+            if max(votes.values(), default=0) + remaining < self.consistency_agreement:
+                break
+        
+        self.run_stats["consistency_images"] += 1
+        self.run_stats["consistency_samples"] += len(samples)
+        self.run_stats["consistency_failed_samples"] += failed
+        
+        if not votes:
+            # Every request failed; there is nothing to agree on
+            return last_error, {"samples": 0, "failed_samples": failed, "agreed": False}
+        
+        # Majority triple set; ties go to the set seen first
+        winner = max(votes, key=votes.get)
+        chosen = next(extracted for triple_set, extracted in samples if triple_set == winner)
+        agreed = votes[winner] >= self.consistency_agreement
+        
+        if not agreed:
+            self.run_stats["contested_images"] += 1
+        
+        stats = {
+            "samples": len(samples),
+            "failed_samples": failed,
+            "agreeing_samples": votes[winner],
+            "agreement": votes[winner] / len(samples),
+            "distinct_triple_sets": len(votes),
+            "agreed": agreed
+        }
+        return chosen, stats
+    
     def evaluate_image(self, image_path: str, ground_truth_sg: List[List[str]]) -> Dict[str, float]:
         """Evaluate a single image against ground truth scene graph"""
-        extracted = self.extract_scene_graph_from_image(image_path)
+        consistency = None
+        if self.consistency_samples > 1:
+            extracted, consistency = self.extract_consistent_scene_graph(image_path)
+        else:
+            extracted = self.extract_scene_graph_from_image(image_path)
         predicted_sg = extracted["scene_graph"]
         predicted_entities = extracted["entities"]
         
@@ -152,25 +973,75 @@ Do not include any other text, explanations, or markdown formatting."""
         entity_iou = self.compute_iou(gt_entities, predicted_entities)
         relation_iou = self.compute_iou(gt_relations, predicted_relations)
         
-        return {
+        metrics = {
             "sg_iou": sg_iou,
             "entity_iou": entity_iou,
             "relation_iou": relation_iou,
             "predicted_sg": predicted_sg,
             "predicted_entities": predicted_entities
         }
+        if "reused_from" in extracted:
+            metrics["reused_from"] = extracted["reused_from"]
+            metrics["reuse_type"] = extracted["reuse_type"]
+        if consistency is not None:
+            metrics["consistency"] = consistency
+        if "cascade" in extracted:
+            metrics["cascade"] = extracted["cascade"]
+        if "error" in extracted:
+            metrics["error"] = extracted["error"]
+        
+        return metrics
+    
+    def collect_images(self, images_dir: str) -> List[Tuple[str, int]]:
+        """
+        List the generated images in a method directory or archive (.tar, .tar.gz, .zip)
+        Returns: sorted list of (image_path, scene_idx); scene_idx is None if it can't be parsed
+        """
+        # Get all image files (sorted to ensure consistent ordering)
+        image_files = list_image_files(images_dir)
+        
+        images = []
+        for img_path in image_files:
+            # Extract the base filename
+            base_name = os.path.basename(img_path)
+            name_without_ext = os.path.splitext(base_name)[0]
+            
+            # --- FILTER MODIFICATION START ---
+            # Skip ground truth/reference images (e.g., "000.png", "015.png")
+            # Only keep generated variants which contain an underscore (e.g., "000_000.png")
+            if '_' not in name_without_ext:
+                # print(f"Skipping reference image: {base_name}")
+                continue
+            # --- FILTER MODIFICATION END ---
+            
+            # Extract scene index from filename
+            # For files like "000.png", "001_002.png", extract the first number
+            scene_idx = None
+            try:
+                # Split by underscore and take first part
+                first_part = name_without_ext.split('_')[0]
+                if first_part.isdigit():
+                    scene_idx = int(first_part)
+            except:
+                pass
+            
+            images.append((img_path, scene_idx))
+        
+        return images
     
     def evaluate_method(self, 
                        images_dir: str, 
                        metadata_file: str,
-                       output_file: str = None) -> Dict:
+                       output_file: str = None,
+                       resume: bool = False) -> Dict:
         """
         Evaluate all images for a method
         
         Args:
-            images_dir: Directory with generated images (e.g., gnn_run/images-30000/images-30000)
+            images_dir: Directory or archive with generated images (e.g., gnn_run/images-30000/images-30000)
             metadata_file: Path to metadata.jsonl or valdata.jsonl file
             output_file: Optional file to save results
+            resume: Keep results already in output_file and only evaluate the rest
         """
         # Load ground truth metadata as a list (preserving order)
         print(f"Loading metadata from: {metadata_file}")
@@ -179,45 +1050,100 @@ Do not include any other text, explanations, or markdown formatting."""
         print(f"Unique objects: {len(self.object_list)}")
         print(f"Unique predicates: {len(self.predicate_list)}")
         
-        results = []
-        total_metrics = {"sg_iou": 0, "entity_iou": 0, "relation_iou": 0}
+        images = self.collect_images(images_dir)
+        previous_results = self.load_previous_results(output_file) if resume else None
+        return self.evaluate_images(images, metadata_list, output_file, previous_results)
+    
+    @staticmethod
+    def load_previous_results(output_file: str) -> List[Dict]:
+        """Per-image results saved by an earlier (possibly partial) run"""
+        if not output_file or not os.path.exists(output_file):
+            return []
+        
+        with open(output_file, 'r') as f:
+            return json.load(f).get("per_image_results", [])
+    
+    @staticmethod
+    def schedule_work(inventory: Dict[str, List[Tuple[str, int]]]) -> List[Tuple[str, str, int]]:
+        """
+        Order images so every method covers every scene once before any scene
+        gets a second variant, and so on
+        
+        Args:
+            inventory: Dict mapping method names to collect_images output
+        Returns: list of (method_name, image_path, scene_idx)
+        """
+        ranked = []
+        for method_order, (method_name, images) in enumerate(inventory.items()):
+            variants_seen = {}
+            for img_path, scene_idx in images:
+                rank = variants_seen.get(scene_idx, 0)
+                variants_seen[scene_idx] = rank + 1
+                sort_key = (rank, scene_idx if scene_idx is not None else -1, method_order)
+                ranked.append((sort_key, method_name, img_path, scene_idx))
         
-        # Get all image files
-        image_files = []
-        for ext in ['*.png', '*.jpg', '*.jpeg', '*.JPG']:
-            image_files.extend(glob.glob(os.path.join(images_dir, ext)))
+        ranked.sort(key=lambda item: item[0])
+        return [(method_name, img_path, scene_idx) for _, method_name, img_path, scene_idx in ranked]
+    
+    def evaluate_images(self,
+                        images: List[Tuple[str, int]],
+                        metadata_list: List[Dict],
+                        output_file: str = None,
+                        previous_results: List[Dict] = None) -> Dict:
+        """
+        Evaluate (image_path, scene_idx) pairs from collect_images against loaded metadata
+        
+        Args:
+            images: Images to evaluate, as returned by collect_images
+            metadata_list: Ground truth entries from load_metadata
+            output_file: Optional file to save results
+            previous_results: Per-image results of an earlier run; these images are not re-evaluated
+                (except failed extractions, which are retried)
+        """
+        self.reset_run_stats()
         
-        # Sort to ensure consistent ordering
-        image_files = sorted(image_files)
+        print(f"\nFound {len(images)} images to evaluate")
         
-        print(f"\nFound {len(image_files)} images to evaluate")
+        results = {None: list(previous_results or [])}
+        work = [(None, img_path, scene_idx) for img_path, scene_idx in images]
+        n_pending, budget_exhausted, method_stats = self._run_work(work, metadata_list, results)
+        
+        return self._summarize_results(
+            results[None], n_pending[None], budget_exhausted, method_stats[None], output_file
+        )
+    
+    def _run_work(self,
+                  work: List[Tuple[str, str, int]],
+                  metadata_list: List[Dict],
+                  results: Dict[str, List[Dict]]) -> Tuple[Dict[str, int], bool, Dict[str, Dict]]:
+        """
+        Evaluate (method_name, image_path, scene_idx) items in order, appending to results[method_name]
+        Stops cleanly once the next image would exceed the token/cost budget.
+        Results of failed extractions from an earlier run are dropped and evaluated again.
+        Returns: (images left unevaluated per method, whether the budget ran out,
+                  request counters and token usage of this run per method)
+        """
+        for method_results in results.values():
+            method_results[:] = [r for r in method_results if "error" not in r]
+        done = {method_name: {r["image"] for r in method_results}
+                for method_name, method_results in results.items()}
+        n_pending = {method_name: 0 for method_name in results}
+        method_stats = {
+            method_name: {"run_stats": dict.fromkeys(self.run_stats, 0), "usage": dict.fromkeys(self.usage, 0)}
+            for method_name in results
+        }
+        budget_exhausted = False
         
         evaluated = 0
         skipped = 0
+        resumed = 0
         
-        for img_path in image_files:
-            # Extract the base filename
+        for method_name, img_path, scene_idx in work:
             base_name = os.path.basename(img_path)
-            name_without_ext = os.path.splitext(base_name)[0]
             
-            # --- FILTER MODIFICATION START ---
-            # Skip ground truth/reference images (e.g., "000.png", "015.png")
-            # Only keep generated variants which contain an underscore (e.g., "000_000.png")
-            if '_' not in name_without_ext:
-                # print(f"Skipping reference image: {base_name}")
+            if base_name in done[method_name]:
+                resumed += 1
                 continue
-            # --- FILTER MODIFICATION END ---
-            
-            # Extract scene index from filename
-            # For files like "000.png", "001_002.png", extract the first number
-            scene_idx = None
-            try:
-                # Split by underscore and take first part
-                first_part = name_without_ext.split('_')[0]
-                if first_part.isdigit():
-                    scene_idx = int(first_part)
-            except:
-                pass
             
             # Get corresponding metadata
             if scene_idx is not None and scene_idx < len(metadata_list):
@@ -227,15 +1153,34 @@ Do not include any other text, explanations, or markdown formatting."""
                 skipped += 1
                 continue
             
-            print(f"Evaluating: {base_name} -> Index {scene_idx} ({matching_meta['caption']})")
+            if not budget_exhausted and not self.within_budget():
+                print(f"\nBudget reached ({self.usage['tokens']} tokens, ${self.usage['cost']:.4f}); "
+                      f"stopping, remaining images are left for a resumed run")
+                budget_exhausted = True
+            if budget_exhausted:
+                n_pending[method_name] += 1
+                continue
+            
+            label = f"[{method_name}] " if method_name is not None else ""
+            print(f"Evaluating: {label}{base_name} -> Index {scene_idx} ({matching_meta['caption']})")
             
             gt_scene_graph = matching_meta['scene_graph']
             gt_caption = matching_meta['caption']
             
             # Evaluate image
+            stats_before, usage_before = dict(self.run_stats), dict(self.usage)
             metrics = self.evaluate_image(img_path, gt_scene_graph)
+            if self.usage["tokens"] > usage_before["tokens"]:
+                self._image_usage.append((self.usage["tokens"] - usage_before["tokens"],
+                                          self.usage["cost"] - usage_before["cost"]))
+            
+            # Attribute this image's requests and tokens to its method
+            for key, value in self.run_stats.items():
+                method_stats[method_name]["run_stats"][key] += value - stats_before[key]
+            for key, value in self.usage.items():
+                method_stats[method_name]["usage"][key] += value - usage_before[key]
             
-            results.append({
+            results[method_name].append({
                 "image": base_name,
                 "scene_index": scene_idx,
                 "caption": gt_caption,
@@ -243,28 +1188,102 @@ Do not include any other text, explanations, or markdown formatting."""
                 **metrics
             })
             
-            total_metrics["sg_iou"] += metrics["sg_iou"]
-            total_metrics["entity_iou"] += metrics["entity_iou"]
-            total_metrics["relation_iou"] += metrics["relation_iou"]
-            
             evaluated += 1
             
-            # Rate limiting
-            time.sleep(2)
+            # Rate limiting (reused extractions made no request)
+            if "reused_from" not in metrics:
+                time.sleep(2)
         
         print(f"\nEvaluated: {evaluated}, Skipped: {skipped}")
+        if resumed:
+            print(f"Already evaluated in a previous run: {resumed}")
+        if budget_exhausted:
+            print(f"Pending (budget): {sum(n_pending.values())}")
         
+        return n_pending, budget_exhausted, method_stats
+    
+    def _summarize_results(self,
+                           results: List[Dict],
+                           n_pending: int,
+                           budget_exhausted: bool,
+                           method_stats: Dict,
+                           output_file: str = None) -> Dict:
+        """
+        Average per-image results, attach statistics and optionally save them
+        
+        run_stats and usage cover this method's images evaluated in this run
+        (from _run_work); run_usage is the evaluator's total, which budgets apply to.
+        Failed extractions are kept in per_image_results but left out of the
+        averages, and mark the results as partial until a resumed run retries them.
+        """
         # Compute averages
-        n_images = len(results)
+        scored = [r for r in results if "error" not in r]
+        n_failed = len(results) - len(scored)
+        n_images = len(scored)
+        partial = n_pending > 0 or n_failed > 0
         avg_metrics = {
-            "sg_iou": total_metrics["sg_iou"] / n_images if n_images > 0 else 0,
-            "entity_iou": total_metrics["entity_iou"] / n_images if n_images > 0 else 0,
-            "relation_iou": total_metrics["relation_iou"] / n_images if n_images > 0 else 0,
-            "n_images": n_images
+            "sg_iou": sum(r["sg_iou"] for r in scored) / n_images if n_images > 0 else 0,
+            "entity_iou": sum(r["entity_iou"] for r in scored) / n_images if n_images > 0 else 0,
+            "relation_iou": sum(r["relation_iou"] for r in scored) / n_images if n_images > 0 else 0,
+            "n_images": n_images,
+            "n_failed": n_failed,
+            "partial": partial
         }
+        if n_failed:
+            print(f"Failed extractions (left out of averages, retried on --resume): {n_failed}")
+        
+        cascade_stats = None
+        if self.cascade_model is not None:
+            # Per-method escalation rate (reused extractions made no request)
+            cascaded = [r["cascade"] for r in results if "cascade" in r]
+            escalated = [c for c in cascaded if c["escalated"]]
+            reasons = {}
+            for c in escalated:
+                reasons[c["reason"]] = reasons.get(c["reason"], 0) + 1
+            cascade_stats = {
+                "fast_model": self.cascade_model,
+                "strong_model": self.model_name,
+                "images": len(cascaded),
+                "escalated": len(escalated),
+                "escalation_rate": len(escalated) / len(cascaded) if cascaded else 0,
+                "reasons": reasons
+            }
+            avg_metrics["escalation_rate"] = cascade_stats["escalation_rate"]
+            print(f"Cascade: {len(escalated)}/{len(cascaded)} images escalated to {self.model_name} {reasons}")
+        
+        run_stats = self.get_run_stats(method_stats["run_stats"])
+        if self.hedge_percentile is not None:
+            print(f"Hedged: {run_stats['hedged']}/{run_stats['requests']} requests "
+                  f"(hedge won {run_stats['hedge_wins']})")
+        print(f"Reused extractions: {run_stats['coalesced']} identical, "
+              f"{run_stats['near_duplicates']} near-duplicate, {run_stats['cache_hits']} from extraction cache")
+        print(f"Responses repaired: {run_stats['parse_repairs']}, "
+              f"re-requested: {run_stats['parse_retries']}")
+        if self.context_cache is not None:
+            print(f"Requests using cached prompt: {run_stats['cached_context_requests']}/{run_stats['requests']} "
+                  f"({method_stats['usage']['cached_tokens']}/{method_stats['usage']['prompt_tokens']} "
+                  f"input tokens from cache)")
+        if self.consistency_samples > 1 and run_stats["consistency_images"] > 0:
+            print(f"Self-consistency: {run_stats['mean_samples_per_image']:.2f} samples/image "
+                  f"({run_stats['mean_draws_per_image']:.2f} draws incl. {run_stats['consistency_failed_samples']} failed), "
+                  f"{run_stats['contested_images']} contested images")
+        if self.upload_cache is not None:
+            print(f"Uploaded files: {self.upload_cache.stats['uploads']} uploaded, "
+                  f"{self.upload_cache.stats['hits']} reused")
+        if self.token_budget is not None or self.cost_budget is not None:
+            print(f"Usage: {method_stats['usage']['tokens']} tokens, ${method_stats['usage']['cost']:.4f} "
+                  f"(run total so far: {self.usage['tokens']} tokens, ${self.usage['cost']:.4f})")
         
         output = {
             "average_metrics": avg_metrics,
+            "partial": partial,
+            "budget_exhausted": budget_exhausted,
+            "n_pending": n_pending,
+            "n_failed": n_failed,
+            "usage": method_stats["usage"],
+            "run_usage": dict(self.usage),
+            "run_stats": run_stats,
+            "cascade": cascade_stats,
             "per_image_results": results
         }
         
@@ -278,17 +1297,91 @@ Do not include any other text, explanations, or markdown formatting."""
     def compare_methods(self, 
                        methods_config: List[Dict],
                        metadata_file: str,
-                       output_dir: str = "evaluation_results"):
+                       output_dir: str = "evaluation_results",
+                       resume: bool = False):
         """
         Compare multiple methods
         
+        With a token or cost budget, images of all methods are interleaved
+        (see schedule_work) and evaluation stops cleanly at the budget; results
+        are then flagged as partial and can be completed with resume=True.
+        
         Args:
             methods_config: List of dicts with 'name' and 'images_dir' keys
+                ('images_dir' may also be a .tar/.tar.gz/.zip archive)
             metadata_file: Path to metadata.jsonl file
             output_dir: Directory to save results
+            resume: Keep per-image results from earlier runs in output_dir
         """
         os.makedirs(output_dir, exist_ok=True)
         
+        if self.token_budget is not None or self.cost_budget is not None:
+            comparison = self._compare_methods_budgeted(methods_config, metadata_file, output_dir, resume)
+        else:
+            comparison = self._compare_methods_sequential(methods_config, metadata_file, output_dir, resume)
+        
+        # Save comparison
+        comparison_file = os.path.join(output_dir, "comparison.json")
+        with open(comparison_file, 'w') as f:
+            json.dump(comparison, f, indent=2)
+        
+        # Print comparison table
+        print(f"\n{'='*70}")
+        print("COMPARISON TABLE")
+        print(f"{'='*70}")
+        print(f"{'Method':<20} {'SG-IoU':>12} {'Entity-IoU':>12} {'Relation-IoU':>12}")
+        print(f"{'-'*70}")
+        for method_name, metrics in comparison.items():
+            print(f"{method_name:<20} {metrics['sg_iou']:>12.3f} "
+                  f"{metrics['entity_iou']:>12.3f} {metrics['relation_iou']:>12.3f}"
+                  f"{'  (partial)' if metrics.get('partial') else ''}")
+        print(f"{'='*70}\n")
+        
+        return comparison
+    
+    def _compare_methods_budgeted(self,
+                                  methods_config: List[Dict],
+                                  metadata_file: str,
+                                  output_dir: str,
+                                  resume: bool) -> Dict:
+        """Evaluate all methods in one budget-aware, scene-balanced schedule"""
+        print(f"Loading metadata from: {metadata_file}")
+        metadata_list = self.load_metadata(metadata_file)
+        print(f"Loaded {len(metadata_list)} entries")
+        
+        inventory = {}
+        output_files = {}
+        results = {}
+        for config in methods_config:
+            method_name = config['name']
+            inventory[method_name] = self.collect_images(config['images_dir'])
+            output_files[method_name] = os.path.join(output_dir, f"{method_name}_results.json")
+            results[method_name] = self.load_previous_results(output_files[method_name]) if resume else []
+        
+        work = self.schedule_work(inventory)
+        print(f"\nScheduled {len(work)} images across {len(inventory)} methods "
+              f"(token budget: {self.token_budget}, cost budget: {self.cost_budget})")
+        
+        self.reset_run_stats()
+        n_pending, budget_exhausted, method_stats = self._run_work(work, metadata_list, results)
+        
+        comparison = {}
+        for method_name in inventory:
+            print(f"\n{method_name}:")
+            output = self._summarize_results(
+                results[method_name], n_pending[method_name], budget_exhausted,
+                method_stats[method_name], output_files[method_name]
+            )
+            comparison[method_name] = output["average_metrics"]
+        
+        return comparison
+    
+    def _compare_methods_sequential(self,
+                                    methods_config: List[Dict],
+                                    metadata_file: str,
+                                    output_dir: str,
+                                    resume: bool) -> Dict:
+        """Evaluate methods one after another"""
         comparison = {}
         
         for config in methods_config:
@@ -301,7 +1394,7 @@ Do not include any other text, explanations, or markdown formatting."""
             
             output_file = os.path.join(output_dir, f"{method_name}_results.json")
             results = self.evaluate_method(
-                images_dir, metadata_file, output_file
+                images_dir, metadata_file, output_file, resume
             )
             
             comparison[method_name] = results["average_metrics"]
@@ -311,23 +1404,120 @@ Do not include any other text, explanations, or markdown formatting."""
             print(f"  Entity-IoU:   {results['average_metrics']['entity_iou']:.3f}")
             print(f"  Relation-IoU: {results['average_metrics']['relation_iou']:.3f}")
         
-        # Save comparison
-        comparison_file = os.path.join(output_dir, "comparison.json")
+        return comparison
+    
+    def run_ablation(self,
+                     prompt_templates: Dict[str, str],
+                     model_names: List[str],
+                     methods_config: List[Dict],
+                     metadata_file: str,
+                     output_dir: str = "evaluation_results/ablation") -> Dict:
+        """
+        Evaluate every (prompt template, model) combination on every method
+        
+        Metadata, the image inventory, content hashing and uploads are done once
+        and shared by the whole grid. Extractions are cached per grid cell in
+        <output_dir>/<prompt>__<model>/extractions.json, so rerunning skips
+        images that were already extracted.
+        
+        Args:
+            prompt_templates: Dict mapping template names to prompt templates
+                (with {object_list} and {predicate_list} placeholders)
+            model_names: Gemini models to compare
+            methods_config: List of dicts with 'name' and 'images_dir' keys
+            metadata_file: Path to metadata.jsonl file
+            output_dir: Directory to save results
+        Returns: dict mapping cell name -> method name -> average metrics
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        
+        print(f"Loading metadata from: {metadata_file}")
+        metadata_list = self.load_metadata(metadata_file)
+        print(f"Loaded {len(metadata_list)} entries")
+        
+        inventory = {}
+        for config in methods_config:
+            inventory[config['name']] = self.collect_images(config['images_dir'])
+            print(f"{config['name']}: {len(inventory[config['name']])} images")
+        
+        print("Preparing images (hashing/uploading once for all grid cells)...")
+        for images in inventory.values():
+            self.prepare_images(images)
+        
+        original_template = self.prompt_template
+        original_model = self.model_name
+        ablation = {}
+        
+        try:
+            for prompt_name, template in prompt_templates.items():
+                for model_name in model_names:
+                    cell = f"{prompt_name}__{model_name}"
+                    cell_dir = os.path.join(output_dir, cell)
+                    os.makedirs(cell_dir, exist_ok=True)
+                    
+                    self.prompt_template = template
+                    self.use_model(model_name)
+                    
+                    cache_file = os.path.join(cell_dir, "extractions.json")
+                    n_cached = self.load_extractions(cache_file)
+                    
+                    print(f"\n{'='*50}")
+                    print(f"Ablation cell: prompt={prompt_name}, model={model_name} "
+                          f"({n_cached} cached extractions)")
+                    print(f"{'='*50}\n")
+                    
+                    ablation[cell] = {}
+                    try:
+                        for method_name, images in inventory.items():
+                            output_file = os.path.join(cell_dir, f"{method_name}_results.json")
+                            results = self.evaluate_images(images, metadata_list, output_file)
+                            ablation[cell][method_name] = {
+                                "prompt": prompt_name,
+                                "model": model_name,
+                                **results["average_metrics"]
+                            }
+                    finally:
+                        self.save_extractions(cache_file)
+        finally:
+            self.prompt_template = original_template
+            self.use_model(original_model)
+        
+        # Save combined comparison
+        comparison_file = os.path.join(output_dir, "ablation_comparison.json")
         with open(comparison_file, 'w') as f:
-            json.dump(comparison, f, indent=2)
+            json.dump(ablation, f, indent=2)
         
-        # Print comparison table
-        print(f"\n{'='*70}")
-        print("COMPARISON TABLE")
-        print(f"{'='*70}")
-        print(f"{'Method':<20} {'SG-IoU':>12} {'Entity-IoU':>12} {'Relation-IoU':>12}")
-        print(f"{'-'*70}")
-        for method_name, metrics in comparison.items():
-            print(f"{method_name:<20} {metrics['sg_iou']:>12.3f} "
-                  f"{metrics['entity_iou']:>12.3f} {metrics['relation_iou']:>12.3f}")
-        print(f"{'='*70}\n")
+        # Print combined table
+        rows = [
+            (method_name, metrics)
+            for cell_results in ablation.values()
+            for method_name, metrics in cell_results.items()
+        ]
         
-        return comparison
+        print(f"\n{'='*90}")
+        print("ABLATION TABLE")
+        print(f"{'='*90}")
+        print(f"{'Prompt':<15} {'Model':<25} {'Method':<15} {'SG-IoU':>10} {'Entity-IoU':>11} {'Relation-IoU':>13}")
+        print(f"{'-'*90}")
+        for method_name, metrics in rows:
+            print(f"{metrics['prompt']:<15} {metrics['model']:<25} {method_name:<15} "
+                  f"{metrics['sg_iou']:>10.3f} {metrics['entity_iou']:>11.3f} {metrics['relation_iou']:>13.3f}")
+        print(f"{'='*90}\n")
+        
+        md = ["# Ablation Results\n"]
+        md.append("| Prompt | Model | Method | SG-IoU ↑ | Entity-IoU ↑ | Relation-IoU ↑ | Images |")
+        md.append("|--------|-------|--------|----------|--------------|----------------|--------|")
+        for method_name, metrics in rows:
+            md.append(f"| {metrics['prompt']} | {metrics['model']} | {method_name} | "
+                      f"{metrics['sg_iou']:.3f} | {metrics['entity_iou']:.3f} | "
+                      f"{metrics['relation_iou']:.3f} | {metrics['n_images']} |")
+        
+        md_file = os.path.join(output_dir, "ablation_table.md")
+        with open(md_file, 'w') as f:
+            f.write("\n".join(md))
+        print(f"Ablation results saved to {comparison_file} and {md_file}")
+        
+        return ablation
 
 
 if __name__ == "__main__":